@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Обработчики отзыва токенов нужны и там, где DRF не загружает
+        # классы аутентификации (админка, команды, другие процессы)
+        from .v1 import authentication  # noqa: F401
@@ -0,0 +1,877 @@
+import base64
+import itertools
+import os
+import tempfile
+import threading
+from contextlib import nullcontext
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.db.models.signals import pre_delete
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image as PILImage
+from recipes import memberships
+from recipes.cart_totals import apply_amounts
+from recipes.images import get_variant, make_variants
+from recipes.models import (Favorite, FeedItem, Ingredient, IngredientToRecipe,
+                            Recipe, ShoppingCart, ShoppingListItem, Tag)
+from recipes.tag_masks import filter_by_tags, update_tags_mask
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import Subscription
+
+User = get_user_model()
+
+
+class RecipeListQueriesTest(TestCase):
+    """Число запросов списка рецептов не зависит от размера страницы"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='user', email='user@example.com'
+        )
+        tags = [
+            Tag.objects.create(
+                name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag-{number}'
+            )
+            for number in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(5)
+        ]
+        for number in range(10):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}', text='Текст', cooking_time=1,
+                author=cls.user
+            )
+            recipe.tags.set(tags[:number % 3 + 1])
+            IngredientToRecipe.objects.bulk_create(
+                IngredientToRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=number + 1
+                )
+                for ingredient in ingredients[:number % 5 + 1]
+            )
+            if number % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+            if number % 3:
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def count_queries(self, client, limit):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(f'/api/recipes/?limit={limit}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), limit)
+        return len(context.captured_queries)
+
+    def assert_constant(self, client):
+        queries = self.count_queries(client, 1)
+        for limit in (3, 9):
+            cache.clear()
+            with self.assertNumQueries(queries):
+                client.get(f'/api/recipes/?limit={limit}')
+
+    def test_anonymous(self):
+        self.assert_constant(APIClient())
+
+    def test_authenticated(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assert_constant(client)
+
+
+class RecipeReadTest(TestCase):
+    """Чтение рецептов отдает состав с ингредиентами и теги
+    и учитывает ?limit="""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(
+            username='author', email='author@example.com'
+        )
+        cls.tag = Tag.objects.create(
+            name='Завтрак', color='#E26C2D', slug='breakfast'
+        )
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(3)
+        ]
+        for number in range(5):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}', text='Текст', cooking_time=1,
+                author=author
+            )
+            recipe.tags.set([cls.tag])
+            IngredientToRecipe.objects.bulk_create(
+                IngredientToRecipe(
+                    recipe=recipe, ingredient=ingredient,
+                    amount=number * 10 + index + 1
+                )
+                for index, ingredient in enumerate(cls.ingredients)
+            )
+        cls.recipe = recipe
+
+    def setUp(self):
+        cache.clear()
+
+    def test_limit(self):
+        response = APIClient().get('/api/recipes/?limit=2')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_detail(self):
+        response = APIClient().get(f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [
+                {key: ingredient[key] for key in (
+                    'id', 'name', 'measurement_unit', 'amount'
+                )}
+                for ingredient in sorted(
+                    response.data['ingredients'], key=lambda row: row['id']
+                )
+            ],
+            [
+                {
+                    'id': ingredient.id, 'name': ingredient.name,
+                    'measurement_unit': 'г', 'amount': 40 + index + 1,
+                }
+                for index, ingredient in enumerate(self.ingredients)
+            ]
+        )
+        self.assertEqual(
+            [tag['slug'] for tag in response.data['tags']], ['breakfast']
+        )
+        self.assertEqual(response.data['author']['username'], 'author')
+
+
+class RecipeWriteQueriesTest(TestCase):
+    """Число запросов записи рецепта не зависит от числа ингредиентов,
+    а подписок и ленты - от размера страницы"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(
+            username='user', email='user@example.com'
+        )
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag-{number}'
+            )
+            for number in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(20)
+        ]
+        for number in range(10):
+            author = User.objects.create(
+                username=f'author{number}',
+                email=f'author{number}@example.com'
+            )
+            for recipe_number in range(number % 3 + 1):
+                recipe = Recipe.objects.create(
+                    name=f'Рецепт {number}.{recipe_number}', text='Текст',
+                    cooking_time=1, author=author
+                )
+                recipe.tags.set(cls.tags[:recipe_number + 1])
+            Subscription.objects.create(user=cls.user, author=author)
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def payload(self, count, amount=1):
+        buffer = BytesIO()
+        PILImage.new('RGB', (8, 8), 'red').save(buffer, 'PNG')
+        image = base64.b64encode(buffer.getvalue()).decode()
+        return {
+            'name': f'Новый рецепт {count}', 'text': 'Текст',
+            'cooking_time': 1, 'image': f'data:image/png;base64,{image}',
+            'tags': [tag.id for tag in self.tags],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': amount}
+                for ingredient in self.ingredients[:count]
+            ],
+        }
+
+    def send(self, method, path, data=None):
+        cache.clear()
+        response = getattr(self.client, method)(path, data, format='json')
+        self.assertLess(response.status_code, 300, response.data)
+        return response
+
+    def count_queries(self, method, path, data=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.send(method, path, data)
+        return len(context.captured_queries), response
+
+    def test_create(self):
+        queries, _ = self.count_queries(
+            'post', '/api/recipes/', self.payload(1)
+        )
+        for count in (5, 20):
+            with self.assertNumQueries(queries):
+                self.send('post', '/api/recipes/', self.payload(count))
+
+    def test_update(self):
+        small = self.send('post', '/api/recipes/', self.payload(1))
+        large = self.send('post', '/api/recipes/', self.payload(20))
+        queries, _ = self.count_queries(
+            'patch', f'/api/recipes/{small.data["id"]}/',
+            {'ingredients': self.payload(1, amount=2)['ingredients']}
+        )
+        with self.assertNumQueries(queries):
+            self.send(
+                'patch', f'/api/recipes/{large.data["id"]}/',
+                {'ingredients': self.payload(20, amount=2)['ingredients']}
+            )
+
+    def assert_constant(self, path):
+        queries, response = self.count_queries('get', path.format(1))
+        self.assertEqual(len(response.data['results']), 1)
+        for limit in (3, 9):
+            with self.assertNumQueries(queries):
+                response = self.send('get', path.format(limit))
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_subscriptions(self):
+        self.assert_constant(
+            '/api/users/subscriptions/?limit={}&recipes_limit=2'
+        )
+
+    def test_feed(self):
+        self.assert_constant('/api/recipes/feed/?limit={}')
+
+
+class KeysetPaginationTest(TestCase):
+    """Пагинация по ключу не теряет записи с почти одинаковым временем"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(
+            username='author', email='author@example.com'
+        )
+        cls.reader = User.objects.create(
+            username='reader', email='reader@example.com'
+        )
+        recipes = [
+            Recipe.objects.create(
+                name=f'Рецепт {number}', text='Текст', cooking_time=1,
+                author=cls.author
+            )
+            for number in range(8)
+        ]
+        # Все записи в пределах одной миллисекунды, две - в одну микросекунду
+        moment = timezone.now().replace(microsecond=123000)
+        for number, recipe in enumerate(recipes):
+            pub_date = moment + timedelta(microseconds=min(number, 6) * 100)
+            Recipe.objects.filter(pk=recipe.pk).update(pub_date=pub_date)
+            FeedItem.objects.create(
+                user=cls.reader, recipe=recipe, author=cls.author,
+                pub_date=pub_date
+            )
+        cls.recipe_ids = [recipe.pk for recipe in recipes]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def collect(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(recipe['id'] for recipe in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_recipes_same_millisecond(self):
+        self.assertEqual(
+            self.collect('/api/recipes/?cursor=&limit=3'),
+            list(reversed(self.recipe_ids))
+        )
+
+    def test_feed_same_millisecond(self):
+        self.assertEqual(
+            self.collect('/api/recipes/feed/?limit=3'),
+            list(reversed(self.recipe_ids))
+        )
+
+
+class ConcurrentRelationsTest(TransactionTestCase):
+    """Параллельные повторы добавления и удаления рецепта создают
+    и удаляют ровно одну строку и меняют счетчик ровно на единицу"""
+    threads = 8
+
+    def setUp(self):
+        cache.clear()
+        # SQLite в памяти не ждет блокировок таблиц между потоками,
+        # поэтому там запросы идут по одному, но из разных потоков
+        self.serial = (
+            threading.Lock()
+            if connection.vendor == 'sqlite' and connection.is_in_memory_db()
+            else nullcontext()
+        )
+        self.user = User.objects.create(
+            username='user', email='user@example.com'
+        )
+        self.recipe = Recipe.objects.create(
+            name='Рецепт', text='Текст', cooking_time=1, author=self.user
+        )
+        IngredientToRecipe.objects.create(
+            recipe=self.recipe,
+            ingredient=Ingredient.objects.create(
+                name='Ингредиент', measurement_unit='г'
+            ),
+            amount=5
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def send_parallel(self, method, path):
+        barrier = threading.Barrier(self.threads)
+        statuses = []
+
+        def send():
+            client = APIClient()
+            client.force_authenticate(self.user)
+            try:
+                barrier.wait()
+                with self.serial:
+                    response = getattr(client, method)(
+                        path() if callable(path) else path
+                    )
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=send) for _ in range(self.threads)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sorted(statuses)
+
+    def assert_state(self, model, counter, flag, present):
+        self.assertEqual(
+            model.objects.filter(user=self.user).count(), int(present)
+        )
+        self.recipe.refresh_from_db()
+        self.assertEqual(getattr(self.recipe, counter), int(present))
+        response = self.client.get(f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(response.data[flag], present)
+        self.assertEqual(response.data[counter], int(present))
+        self.assertEqual(
+            list(ShoppingListItem.objects.values_list(
+                'total_amount', flat=True
+            )),
+            [5] if present and model is ShoppingCart else []
+        )
+
+    def check_toggle(self, url_path, model, counter, flag):
+        path = f'/api/recipes/{self.recipe.id}/{url_path}/'
+        self.assertEqual(
+            self.send_parallel('post', path),
+            [201] + [400] * (self.threads - 1)
+        )
+        self.assert_state(model, counter, flag, True)
+        self.assertEqual(
+            self.send_parallel('delete', path),
+            [204] + [400] * (self.threads - 1)
+        )
+        self.assert_state(model, counter, flag, False)
+
+    def test_favorite(self):
+        self.check_toggle(
+            'favorite', Favorite, 'favorite_count', 'is_favorited'
+        )
+
+    def test_shopping_cart(self):
+        self.check_toggle(
+            'shopping_cart', ShoppingCart, 'cart_count',
+            'is_in_shopping_cart'
+        )
+
+    def test_cart_shared_ingredient(self):
+        """Рецепты с общим ингредиентом, параллельно добавленные
+        в одну корзину, складываются в одну строку итогов"""
+        ingredient = Ingredient.objects.get()
+        recipes = []
+        for number in range(self.threads):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}', text='Текст', cooking_time=1,
+                author=self.user
+            )
+            IngredientToRecipe.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=number + 1
+            )
+            recipes.append(recipe)
+        paths = iter(
+            f'/api/recipes/{recipe.id}/shopping_cart/' for recipe in recipes
+        )
+        lock = threading.Lock()
+
+        def next_path():
+            with lock:
+                return next(paths)
+
+        self.assertEqual(
+            self.send_parallel('post', next_path), [201] * self.threads
+        )
+        self.assertEqual(
+            list(ShoppingListItem.objects.values_list(
+                'total_amount', flat=True
+            )),
+            [sum(range(1, self.threads + 1))]
+        )
+
+    def test_pre_delete_sees_row(self):
+        seen = []
+
+        def removing(instance, **kwargs):
+            seen.append(Favorite.objects.filter(pk=instance.pk).exists())
+
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        pre_delete.connect(removing, sender=Favorite)
+        try:
+            response = self.client.delete(
+                f'/api/recipes/{self.recipe.id}/favorite/'
+            )
+        finally:
+            pre_delete.disconnect(removing, sender=Favorite)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(seen, [True])
+
+
+class CachedTokenTest(TestCase):
+    """Закэшированный токен отзывается выходом и деактивацией"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='user', email='user@example.com'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+
+    def assert_revoked(self):
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_deactivate(self):
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assert_revoked()
+
+    def test_logout(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+        self.assert_revoked()
+
+
+class CounterSaveTest(TestCase):
+    """Сохранение устаревшего объекта не затирает счетчики"""
+
+    def test_stale_save(self):
+        user = User.objects.create(username='user', email='user@example.com')
+        recipe = Recipe.objects.create(
+            name='Рецепт', text='Текст', cooking_time=1, author=user
+        )
+        stale_user = User.objects.get(pk=user.pk)
+        stale_recipe = Recipe.objects.get(pk=recipe.pk)
+        Favorite.objects.create(user=user, recipe=recipe)
+        Recipe.objects.create(
+            name='Второй', text='Текст', cooking_time=1, author=user
+        )
+        stale_user.first_name = 'Имя'
+        stale_user.save()
+        stale_recipe.name = 'Новое название'
+        stale_recipe.save()
+        user.refresh_from_db()
+        recipe.refresh_from_db()
+        self.assertEqual(
+            (user.first_name, user.recipes_count), ('Имя', 2)
+        )
+        self.assertEqual(
+            (recipe.name, recipe.favorite_count), ('Новое название', 1)
+        )
+
+
+class MembershipsTest(TestCase):
+    """Изменение, зафиксированное во время загрузки множества,
+    не теряется в кэше"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='user', email='user@example.com'
+        )
+        self.recipes = [
+            Recipe.objects.create(
+                name=f'Рецепт {number}', text='Текст', cooking_time=1,
+                author=self.user
+            )
+            for number in range(3)
+        ]
+
+    def favorite(self, recipe):
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.user, recipe=recipe)
+
+    def test_change_during_load(self):
+        load = memberships.load_members
+
+        def load_then_change(user_id, kind):
+            members = load(user_id, kind)
+            self.favorite(self.recipes[1])
+            return members
+
+        self.favorite(self.recipes[0])
+        with mock.patch.object(
+            memberships, 'load_members', load_then_change
+        ):
+            self.assertEqual(
+                memberships.get_members(self.user.id, 'favorites'),
+                {self.recipes[0].id}
+            )
+        self.assertEqual(
+            memberships.get_members(self.user.id, 'favorites'),
+            {self.recipes[0].id, self.recipes[1].id}
+        )
+
+    def test_changes_after_load(self):
+        memberships.get_members(self.user.id, 'favorites')
+        self.favorite(self.recipes[0])
+        self.favorite(self.recipes[2])
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.filter(recipe=self.recipes[0]).delete()
+        self.assertEqual(
+            memberships.get_members(self.user.id, 'favorites'),
+            {self.recipes[2].id}
+        )
+
+
+class CartTotalsTest(TestCase):
+    """Строка итогов, вставленная параллельной транзакцией,
+    не приводит к ошибке и не теряет количество"""
+
+    def test_row_inserted_concurrently(self):
+        user = User.objects.create(username='user', email='user@example.com')
+        ingredient = Ingredient.objects.create(
+            name='Ингредиент', measurement_unit='г'
+        )
+        bulk_create = ShoppingListItem.objects.bulk_create
+
+        def insert_first(objects, **kwargs):
+            ShoppingListItem.objects.create(
+                user=user, ingredient=ingredient, total_amount=3
+            )
+            return bulk_create(objects, **kwargs)
+
+        with mock.patch.object(
+            ShoppingListItem.objects, 'bulk_create', insert_first
+        ):
+            apply_amounts([user.id], {ingredient.id: 2})
+        self.assertEqual(
+            list(ShoppingListItem.objects.values_list(
+                'total_amount', flat=True
+            )),
+            [5]
+        )
+
+
+class TagMaskTest(TestCase):
+    """Фильтр по маске тегов совпадает с фильтром через JOIN"""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(
+            username='author', email='author@example.com'
+        )
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag-{number}'
+            )
+            for number in range(4)
+        ]
+        # Тег без бита: фильтр по нему идет через JOIN
+        Tag.objects.filter(pk=cls.tags[3].pk).update(bit=None)
+        cls.tags[3].bit = None
+        for number in range(16):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}', text='Текст', cooking_time=1,
+                author=author
+            )
+            tags = [
+                tag for bit, tag in enumerate(cls.tags) if number >> bit & 1
+            ]
+            recipe.tags.set(tags)
+            update_tags_mask(recipe)
+
+    def expected(self, tags, match_all):
+        recipes = Recipe.objects.prefetch_related('tags')
+        return {
+            recipe.id for recipe in recipes
+            if (all if match_all else any)(
+                tag in recipe.tags.all() for tag in tags
+            )
+        }
+
+    def test_filter(self):
+        for size in range(1, len(self.tags) + 1):
+            for tags in itertools.combinations(self.tags, size):
+                for match_all in (False, True):
+                    with self.subTest(tags=tags, match_all=match_all):
+                        self.assertEqual(
+                            set(filter_by_tags(
+                                Recipe.objects.all(), tags, match_all
+                            ).values_list('id', flat=True)),
+                            self.expected(tags, match_all)
+                        )
+
+    def test_api(self):
+        response = APIClient().get(
+            '/api/recipes/?tags=tag-0&tags=tag-3&limit=100'
+        )
+        self.assertEqual(
+            {recipe['id'] for recipe in response.data['results']},
+            self.expected([self.tags[0], self.tags[3]], False)
+        )
+
+    def test_bit_taken_concurrently(self):
+        with mock.patch.object(
+            Tag.objects, 'exclude', return_value=Tag.objects.none()
+        ):
+            tag = Tag.objects.create(name='Новый', color='#0000ff', slug='new')
+        self.assertEqual(tag.bit, 3)
+        tag.refresh_from_db()
+        self.assertEqual(tag.bit, 3)
+
+
+@override_settings(IMAGE_WORKERS=0)
+class ImageVariantsTest(TestCase):
+    """Варианты изображения пересоздаются при смене настроек
+    и удаляются вместе с изображением"""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media_root = media.name
+        media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.user = User.objects.create(
+            username='user', email='user@example.com'
+        )
+
+    def image(self, color):
+        buffer = BytesIO()
+        PILImage.new('RGB', (32, 32), color).save(buffer, 'PNG')
+        return ContentFile(buffer.getvalue(), name=f'{color}.png')
+
+    def create_recipe(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipe.objects.create(
+                name='Рецепт', text='Текст', cooking_time=1,
+                author=self.user, image=self.image('red')
+            )
+        recipe.refresh_from_db()
+        return recipe
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media_root)
+            for root, _, names in os.walk(self.media_root)
+            for name in names
+        )
+
+    def test_settings_change(self):
+        recipe = self.create_recipe()
+        thumbnail = get_variant(recipe, 'thumbnail')
+        self.assertIn(thumbnail, self.stored_files())
+        with override_settings(IMAGE_QUALITY=50):
+            self.assertIsNone(get_variant(recipe, 'thumbnail'))
+            make_variants(recipe.id, recipe.image.name)
+            recipe.refresh_from_db()
+            new_thumbnail = get_variant(recipe, 'thumbnail')
+        self.assertNotEqual(new_thumbnail, thumbnail)
+        self.assertIn(new_thumbnail, self.stored_files())
+
+    def test_stale_save(self):
+        recipe = self.create_recipe()
+        stale = Recipe.objects.get(pk=recipe.pk)
+        with override_settings(IMAGE_QUALITY=50):
+            make_variants(recipe.id, recipe.image.name)
+            recipe.refresh_from_db()
+            stale.name = 'Новое название'
+            stale.save()
+            stale.refresh_from_db()
+            self.assertEqual(stale.image_variants, recipe.image_variants)
+            self.assertIsNotNone(get_variant(stale, 'thumbnail'))
+
+    def test_replace(self):
+        recipe = self.create_recipe()
+        recipe.image = self.image('blue')
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.save()
+        recipe.refresh_from_db()
+        self.assertEqual(
+            self.stored_files(), sorted(recipe.image_variants.values())
+        )
+
+    def test_release(self):
+        recipe = self.create_recipe()
+        with override_settings(IMAGE_QUALITY=50):
+            make_variants(recipe.id, recipe.image.name)
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        self.assertEqual(self.stored_files(), [])
+
+
+class SnapshotResponseTest(TestCase):
+    """Условные запросы и сжатие снимков справочников"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_if_modified_since_ignored(self):
+        response = self.client.get(
+            '/api/tags/',
+            HTTP_IF_MODIFIED_SINCE='Wed, 21 Oct 2099 07:28:00 GMT'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_etag(self):
+        etag = self.client.get('/api/tags/')['ETag']
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_accept_encoding(self):
+        for header, encoding in (
+            ('gzip', 'gzip'),
+            ('deflate, gzip;q=0.5', 'gzip'),
+            ('*', 'gzip'),
+            ('gzip;q=0, deflate', None),
+            ('*;q=0', None),
+            ('identity', None),
+        ):
+            with self.subTest(header=header):
+                response = self.client.get(
+                    '/api/tags/', HTTP_ACCEPT_ENCODING=header
+                )
+                self.assertEqual(response.get('Content-Encoding'), encoding)
+                self.assertIn('Accept-Encoding', response['Vary'])
+
+
+class IngredientListTest(TestCase):
+    """Пустые параметры поиска ингредиентов отдают полный список"""
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number:02}', measurement_unit='г')
+            for number in range(30)
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_empty_parameters(self):
+        client = APIClient()
+        full = client.get('/api/ingredients/').json()
+        self.assertEqual(len(full), 30)
+        for query in ('?name=', '?search=', '?name=&search='):
+            with self.subTest(query=query):
+                self.assertEqual(
+                    client.get(f'/api/ingredients/{query}').json(), full
+                )
+
+    def test_name(self):
+        response = APIClient().get('/api/ingredients/?name=Ингредиент 1')
+        self.assertEqual(
+            [ingredient['name'] for ingredient in response.data],
+            [f'Ингредиент {number}' for number in range(10, 20)]
+        )
+
+
+class CountCacheTest(TestCase):
+    """Количество рецептов в кэше сбрасывают только изменения таблиц,
+    которые читает подсчет"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            username='user', email='user@example.com'
+        )
+        for number in range(3):
+            Recipe.objects.create(
+                name=f'Рецепт {number}', text='Текст', cooking_time=1,
+                author=self.user
+            )
+        self.client = APIClient()
+
+    def get_count(self):
+        """Количество на странице и был ли выполнен COUNT"""
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/recipes/?page=1')
+        counted = any(
+            'COUNT(' in query['sql'].upper()
+            for query in context.captured_queries
+        )
+        return response.data['count'], counted
+
+    def test_unrelated_writes(self):
+        self.assertEqual(self.get_count(), (3, True))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Имя'
+            self.user.save()
+            Favorite.objects.create(
+                user=self.user, recipe=Recipe.objects.first()
+            )
+        self.assertEqual(self.get_count(), (3, False))
+
+    def test_new_recipe(self):
+        self.assertEqual(self.get_count(), (3, True))
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.create(
+                name='Новый', text='Текст', cooking_time=1, author=self.user
+            )
+        self.assertEqual(self.get_count(), (4, True))
@@ -0,0 +1,149 @@
+"""Аутентификация по токену с кэшем в памяти процесса.
+Запрос с известным токеном не обращается к БД: запись кэша сверяется
+с версией токена в общем кэше, которую меняют выход, смена пароля
+и деактивация в любом процессе"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.translation import gettext_lazy as _
+from recipes.cache import bump_version_on_commit, get_version
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+User = get_user_model()
+
+# Поля снимка пользователя; остальные (пароль, счетчики)
+# отложены и загружаются из БД только при обращении к ним
+SNAPSHOT_FIELDS = (
+    'id',
+    'username',
+    'email',
+    'first_name',
+    'last_name',
+    'is_active',
+    'is_staff',
+    'is_superuser',
+)
+# Версия токена в общем кэше; ключ - токен, а не пользователь, чтобы
+# версию можно было прочитать до запроса к БД
+AUTH_VERSION = 'auth:{}'
+# Поля, изменение которых должно отозвать закэшированные токены
+AUTH_FIELDS = {*SNAPSHOT_FIELDS, 'password'}
+
+
+class TokenCache:
+    """LRU-кэш в памяти процесса: ключ токена -> снимок пользователя
+    и версия токена, с которой он загружен. Запись действительна, пока
+    версия в общем кэше не изменилась, и не дольше ttl секунд"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.keys_by_user = {}
+        self.lock = threading.Lock()
+        # from_db ждет значения в порядке полей модели
+        self.fields = [
+            field.attname for field in User._meta.concrete_fields
+            if field.attname in SNAPSHOT_FIELDS
+        ]
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, user_id, version, values = entry
+            if expires < time.monotonic():
+                self._pop(key)
+                return None
+            self.entries.move_to_end(key)
+        if get_version(AUTH_VERSION.format(key)) != version:
+            self.delete(key)
+            return None
+        return User.from_db('default', self.fields, values)
+
+    def set(self, key, user, version):
+        values = tuple(getattr(user, field) for field in self.fields)
+        with self.lock:
+            self._pop(key)
+            self.entries[key] = (
+                time.monotonic() + self.ttl, user.id, version, values
+            )
+            self.keys_by_user.setdefault(user.id, set()).add(key)
+            while len(self.entries) > self.maxsize:
+                self._pop(next(iter(self.entries)))
+
+    def _pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            keys = self.keys_by_user.get(entry[1], set())
+            keys.discard(key)
+            if not keys:
+                self.keys_by_user.pop(entry[1], None)
+
+    def delete(self, key):
+        with self.lock:
+            self._pop(key)
+
+    def delete_user(self, user_id):
+        with self.lock:
+            for key in list(self.keys_by_user.get(user_id, ())):
+                self._pop(key)
+
+
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, которая обращается к БД только при промахе
+    кэша токенов. Кэш сбрасывается при выходе (удалении токена),
+    смене пароля и деактивации во всех процессах"""
+
+    def authenticate_credentials(self, key):
+        user = token_cache.get(key)
+        if user is None:
+            # Версия читается до запроса к БД: изменение, зафиксированное
+            # после него, сменит версию и запись не пройдет проверку
+            version = get_version(AUTH_VERSION.format(key))
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, user, version)
+            return user, token
+        if not user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        return user, Token(key=key, user=user)
+
+
+@receiver([post_save, post_delete], sender=Token)
+def token_changed(instance, **kwargs):
+    """Отзывает токен в кэшах всех процессов"""
+    token_cache.delete(instance.key)
+    bump_version_on_commit(AUTH_VERSION.format(instance.key))
+
+
+@receiver(post_save, sender=User)
+def user_changed(instance, created, update_fields=None, **kwargs):
+    """Отзывает токены пользователя при смене пароля, деактивации
+    и других изменениях снимка. Сохранение только прочих полей
+    (например, last_login при входе) токены не трогает"""
+    if created or (
+        update_fields is not None and not AUTH_FIELDS & set(update_fields)
+    ):
+        return
+    token_cache.delete_user(instance.id)
+    for key in Token.objects.filter(user_id=instance.id).values_list(
+        'key', flat=True
+    ):
+        bump_version_on_commit(AUTH_VERSION.format(key))
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(instance, **kwargs):
+    """Токены удаляются каскадно и отзываются в token_changed"""
+    token_cache.delete_user(instance.id)
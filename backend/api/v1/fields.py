@@ -0,0 +1,36 @@
+from django.core.files.storage import default_storage
+from recipes.images import get_variant
+from rest_framework import serializers
+
+
+class RecipeImageField(serializers.ImageField):
+    """Ссылка на вариант изображения рецепта (см. IMAGE_VARIANTS).
+    Вариант из контекста по ключу context_key важнее аргумента variant.
+    Пока вариант не готов, отдается исходное изображение
+    (или None при fallback=False)"""
+
+    def __init__(self, variant=None, context_key='image_variant',
+                 fallback=True, **kwargs):
+        self.variant = variant
+        self.context_key = context_key
+        self.fallback = fallback
+        kwargs.setdefault('read_only', True)
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        return instance.image
+
+    def to_representation(self, value):
+        variant = self.variant
+        if self.context_key:
+            variant = self.context.get(self.context_key, variant)
+        name = value and variant and get_variant(value.instance, variant)
+        if name:
+            url = default_storage.url(name)
+            request = self.context.get('request')
+            if request is not None:
+                return request.build_absolute_uri(url)
+            return url
+        if not self.fallback:
+            return None
+        return super().to_representation(value)
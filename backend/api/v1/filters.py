@@ -1,6 +1,9 @@
 from django.contrib.auth import get_user_model
 from django_filters.rest_framework import FilterSet, filters
+from recipes.memberships import get_members
 from recipes.models import Ingredient, Recipe, Tag
+from recipes.search import search_recipes
+from recipes.tag_masks import filter_by_tags
 
 User = get_user_model()
 
@@ -9,7 +12,12 @@ class RecipeFilter(FilterSet):
     tags = filters.ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name='slug',
-        queryset=Tag.objects.all()
+        queryset=Tag.objects.all(),
+        method='filter_tags',
+    )
+    tags_match = filters.ChoiceFilter(
+        choices=(('any', 'Любой из тегов'), ('all', 'Все теги')),
+        method='filter_tags_match',
     )
     author = filters.ModelChoiceFilter(
         queryset=User.objects.all()
@@ -20,17 +28,38 @@ class RecipeFilter(FilterSet):
     is_favorited = filters.BooleanFilter(
         method='filter_is_favorited',
     )
+    search = filters.CharFilter(
+        method='filter_search',
+    )
+
+    def filter_tags(self, queryset, name, value):
+        return filter_by_tags(
+            queryset,
+            value,
+            match_all=self.form.cleaned_data.get('tags_match') == 'all'
+        )
+
+    def filter_tags_match(self, queryset, name, value):
+        """Режим учитывается в filter_tags"""
+        return queryset
+
+    def filter_search(self, queryset, name, value):
+        """Полнотекстовый поиск по названию и описанию,
+        сначала самые релевантные рецепты"""
+        if not value.strip():
+            return queryset
+        return search_recipes(queryset, value)
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         user = self.request.user
         if value and not user.is_anonymous:
-            return queryset.filter(shopping_cart_r__user=user)
+            return queryset.filter(pk__in=get_members(user.id, 'cart'))
         return queryset
 
     def filter_is_favorited(self, queryset, name, value):
         user = self.request.user
         if value and not user.is_anonymous:
-            return queryset.filter(favorite_recipe__user=user)
+            return queryset.filter(pk__in=get_members(user.id, 'favorites'))
         return queryset
 
     class Meta:
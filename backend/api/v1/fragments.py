@@ -0,0 +1,119 @@
+"""Кэш представлений рецептов. Кэшируется общая для всех пользователей
+часть, флаги пользователя и счетчики строки подставляются при ответе"""
+import hashlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch, prefetch_related_objects
+from recipes.cache import (RECIPE_VERSION, USER_VERSION, count_hits,
+                           get_versions)
+from recipes.models import IngredientToRecipe
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+FRAGMENTS = 'recipe_fragments'
+USER_FIELDS = ('is_favorited', 'is_in_shopping_cart')
+ROW_FIELDS = ('favorite_count', 'cart_count')
+SHARED_VERSIONS = ('ingredients', 'tags')
+FRAGMENT_PREFETCH = (
+    Prefetch(
+        'recipe',
+        queryset=IngredientToRecipe.objects.select_related('ingredient')
+    ),
+    'tags',
+)
+
+
+def get_fragment_key(recipe, versions, context):
+    """Ключ зависит от версий рецепта, автора и справочников, а также
+    от вариантов изображений и адреса сайта в ссылках"""
+    parts = (
+        versions,
+        context.get('image_variant'),
+        context.get('image_webp_variant'),
+        context['request'].build_absolute_uri('/'),
+    )
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+    return f'fragment:recipe:{recipe.pk}:{digest}'
+
+
+class FragmentListSerializer(serializers.ListSerializer):
+    """Список рецептов: все фрагменты читаются из кэша одним запросом"""
+
+    def to_representation(self, data):
+        recipes = data.all() if hasattr(data, 'all') else data
+        return self.child.to_representation_many(list(recipes))
+
+
+class FragmentCacheMixin:
+    """Кэширует представление рецепта по его версии (см. recipes.signals).
+    Связанные ингредиенты и теги подгружаются только для промахов"""
+
+    def to_representation(self, instance):
+        return self.to_representation_many([instance])[0]
+
+    def to_representation_many(self, recipes):
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            # Ответ на запись строится по объекту в памяти, который
+            # может отличаться от строки в БД - такое не кэшируется
+            prefetch_related_objects(recipes, *FRAGMENT_PREFETCH)
+            return [
+                super(FragmentCacheMixin, self).to_representation(recipe)
+                for recipe in recipes
+            ]
+        names = list(SHARED_VERSIONS)
+        for recipe in recipes:
+            names.append(RECIPE_VERSION.format(recipe.pk))
+            names.append(USER_VERSION.format(recipe.author_id))
+        versions = get_versions(names)
+        shared = versions[:len(SHARED_VERSIONS)]
+        own = versions[len(SHARED_VERSIONS):]
+        keys = [
+            get_fragment_key(
+                recipe, shared + own[2 * number:2 * number + 2], self.context
+            )
+            for number, recipe in enumerate(recipes)
+        ]
+        fragments = cache.get_many(keys)
+        missing = {
+            key: recipe for key, recipe in zip(keys, recipes)
+            if key not in fragments
+        }
+        if missing:
+            prefetch_related_objects(
+                list(missing.values()), *FRAGMENT_PREFETCH
+            )
+            rendered = {
+                key: super(FragmentCacheMixin, self).to_representation(recipe)
+                for key, recipe in missing.items()
+            }
+            cache.set_many(rendered, settings.RECIPE_FRAGMENT_TTL)
+            fragments.update(rendered)
+        count_hits(FRAGMENTS, len(keys) - len(missing), len(missing))
+        return [
+            self.apply_user_fields(fragments[key], recipe)
+            for key, recipe in zip(keys, recipes)
+        ]
+
+    def apply_user_fields(self, fragment, recipe):
+        """Подставляет во фрагмент флаги текущего пользователя
+        и счетчики, которые уже загружены вместе с рецептом"""
+        values = {
+            name: getattr(self, f'get_{name}')(recipe) for name in USER_FIELDS
+        }
+        values.update(
+            (name, getattr(recipe, name)) for name in ROW_FIELDS
+        )
+        data = OrderedDict(
+            (name, values[name] if name in values else fragment[name])
+            for name in fragment
+        )
+        data['author'] = OrderedDict(
+            data['author'],
+            is_subscribed=self.fields['author'].get_is_subscribed(
+                recipe.author
+            )
+        )
+        return data
@@ -1,5 +1,214 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import hashlib
+import json
+from datetime import datetime
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+from recipes.cache import get_versions
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+def estimate_count(queryset):
+    """Оценка планировщика PostgreSQL, если она не меньше
+    COUNT_ESTIMATE_THRESHOLD, иначе точный COUNT"""
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        estimate = int(plan[0]['Plan']['Plan Rows'])
+        if estimate >= settings.COUNT_ESTIMATE_THRESHOLD:
+            return estimate
+    return queryset.count()
+
+
+def get_count_tables(queryset):
+    """Таблицы, от которых зависит количество записей: из FROM и JOIN
+    условий и из подзапросов в WHERE. Таблицы select_related
+    и аннотаций, не участвующих в условиях, на количество не влияют"""
+    query = queryset.query
+    compiler = query.get_compiler(queryset.db)
+    where_sql, _ = compiler.compile(query.where)
+    quote_name = compiler.connection.ops.quote_name
+    tables = {query.model._meta.db_table}
+    tables.update(
+        join.table_name for alias, join in query.alias_map.items()
+        if query.alias_refcount[alias]
+    )
+    tables.update(
+        model._meta.db_table
+        for model in apps.get_models(include_auto_created=True)
+        if quote_name(model._meta.db_table) in where_sql
+    )
+    return sorted(tables)
+
+
+def get_count(queryset):
+    """Количество записей с кэшем на COUNT_CACHE_TTL секунд.
+    Ключ - SQL запроса и версии таблиц, которые читает подсчет,
+    поэтому изменение любой из них (сигналы моделей) сбрасывает кэш"""
+    if not isinstance(queryset, QuerySet):
+        return len(queryset)
+    try:
+        sql, params = queryset.query.sql_with_params()
+        tables = get_count_tables(queryset)
+    except EmptyResultSet:
+        return 0
+    versions = get_versions(f'table:{table}' for table in tables)
+    key = 'count:' + hashlib.sha1(
+        repr((sql, params, versions)).encode()
+    ).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = estimate_count(queryset)
+        cache.set(key, count, settings.COUNT_CACHE_TTL)
+    return count
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator, берущий количество записей из get_count"""
+
+    @cached_property
+    def count(self):
+        return get_count(self.object_list)
+
+
+class KeysetPagination(BasePagination):
+    """Пагинация по ключу: следующая страница выбирается условием
+    на поля сортировки последней записи, без COUNT и OFFSET.
+    Последнее поле ordering должно быть уникальным"""
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    ordering = ('-pub_date', '-id')
+    invalid_cursor_message = 'Неверный курсор'
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = ordering
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_fields(self):
+        return [
+            (field.lstrip('-'), field.startswith('-'))
+            for field in self.ordering
+        ]
+
+    def encode_cursor(self, values):
+        # Время кодируется с микросекундами: DjangoJSONEncoder обрезает
+        # его до миллисекунд, и записи из той же миллисекунды, что
+        # и последняя на странице, пропускались бы
+        data = json.dumps(
+            [
+                value.isoformat() if isinstance(value, datetime) else value
+                for value in values
+            ],
+            cls=DjangoJSONEncoder
+        ).encode()
+        return base64.urlsafe_b64encode(data).decode()
+
+    def decode_cursor(self, request, model):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            fields = self.get_fields()
+            if len(values) != len(fields):
+                raise ValueError
+            return [
+                model._meta.get_field(name).to_python(value)
+                for (name, _), value in zip(fields, values)
+            ]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_keyset_filter(self, values):
+        """(a, b) после (x, y) при a < x или a = x и b < y
+        (для полей по возрастанию - наоборот)"""
+        condition = None
+        for (name, descending), value in reversed(
+            list(zip(self.get_fields(), values))
+        ):
+            lookup = Q(**{f'{name}__{"lt" if descending else "gt"}': value})
+            if condition is not None:
+                lookup |= Q(**{name: value}) & condition
+            condition = lookup
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        values = self.decode_cursor(request, queryset.model)
+        if values is not None:
+            queryset = queryset.filter(self.get_keyset_filter(values))
+        page = list(queryset[:page_size + 1])
+        self.next_values = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_values = [
+                getattr(page[-1], name) for name, _ in self.get_fields()
+            ]
+        return page
+
+    def get_next_link(self):
+        if self.next_values is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.encode_cursor(self.next_values)
+        )
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
 
 
 class CustomPagination(PageNumberPagination):
+    """Постраничная пагинация с ?page= и ?limit=, количество записей
+    кэшируется (см. get_count). С параметром
+    ?cursor= (пустой - первая страница) переключается на пагинацию
+    по ключу в порядке keyset_ordering вьюсета"""
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    django_paginator_class = CachedCountPaginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.cursor_query_param in request.query_params:
+            self.keyset = KeysetPagination(
+                ordering=getattr(view, 'keyset_ordering', None)
+            )
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,94 @@
+import json
+
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from rest_framework import serializers, status
+from rest_framework.exceptions import APIException
+from rest_framework.parsers import DataAndFiles, MultiPartParser
+
+# Сигнатуры форматов, которые принимаются как изображения рецептов
+IMAGE_SIGNATURES = (
+    b'\xff\xd8\xff',
+    b'\x89PNG\r\n\x1a\n',
+    b'GIF87a',
+    b'GIF89a',
+    b'RIFF',
+)
+
+
+class ImageTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Изображение слишком большое'
+    default_code = 'image_too_large'
+
+
+def check_image_size(size):
+    """Проверяет размер изображения по RECIPE_IMAGE_MAX_SIZE"""
+    if size > settings.RECIPE_IMAGE_MAX_SIZE:
+        raise ImageTooLarge(
+            f'Размер изображения не должен превышать '
+            f'{settings.RECIPE_IMAGE_MAX_SIZE // 1024 ** 2} МБ'
+        )
+
+
+def is_image_header(header):
+    """Похожи ли первые байты файла на поддерживаемое изображение"""
+    if header.startswith(b'RIFF'):
+        return header[8:12] == b'WEBP'
+    return header.startswith(IMAGE_SIGNATURES)
+
+
+class ImageUploadHandler(TemporaryFileUploadHandler):
+    """Пишет загружаемый файл сразу во временный файл на диске,
+    обрывая загрузку при превышении размера или не-изображении"""
+
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+                         encoding=None):
+        """Отклоняет запрос до чтения тела, если он заведомо больше
+        изображения и обычных полей формы вместе"""
+        check_image_size(
+            content_length - (settings.DATA_UPLOAD_MAX_MEMORY_SIZE or 0)
+        )
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        if not self.content_type.startswith('image/'):
+            raise serializers.ValidationError(
+                {self.field_name: 'Загрузите изображение'}
+            )
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        if start == 0 and not is_image_header(raw_data[:12]):
+            raise serializers.ValidationError(
+                {self.field_name: 'Файл не является изображением'}
+            )
+        self.received += len(raw_data)
+        check_image_size(self.received)
+        return super().receive_data_chunk(raw_data, start)
+
+
+class RecipeMultiPartParser(MultiPartParser):
+    """multipart/form-data для рецептов: изображение передается файлом,
+    ingredients - json-строкой, tags - json-строкой или повтором поля"""
+    json_fields = ('ingredients', 'tags')
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        request._request.upload_handlers = [
+            ImageUploadHandler(request._request)
+        ]
+        result = super().parse(stream, media_type, parser_context)
+        data = result.data.dict()
+        for field in self.json_fields:
+            values = result.data.getlist(field)
+            if len(values) == 1 and values[0].lstrip().startswith('['):
+                try:
+                    data[field] = json.loads(values[0])
+                except ValueError:
+                    raise serializers.ValidationError(
+                        {field: 'Ожидается json-массив'}
+                    )
+            elif values:
+                data[field] = values
+        return DataAndFiles(data, result.files.dict())
@@ -3,11 +3,20 @@ import base64
 import webcolors
 from django.core.files.base import ContentFile
 from django.db import transaction
+from foodgram.settings import RECIPES_BATCH_SIZE
+from recipes.cache import RECIPE_VERSION, bump_version_on_commit
+from recipes.cart_totals import apply_recipe_change
+from recipes.images import is_same_image
 from recipes.models import (Favorite, Ingredient, IngredientToRecipe, Recipe,
                             ShoppingCart, Tag)
+from recipes.tag_masks import get_tags_mask
 from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator
-from .serializers_users import MyUserSerializer
+
+from .fields import RecipeImageField
+from .fragments import FragmentCacheMixin, FragmentListSerializer
+from .parsers import check_image_size
+from .serializers_users import MyUserSerializer, get_user_members
 
 
 class Hex2NameColor(serializers.Field):
@@ -28,6 +37,7 @@ class Base64ImageField(serializers.ImageField):
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
+            check_image_size(len(imgstr) * 3 // 4)
             ext = format.split('/')[-1]
             data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
         return super().to_internal_value(data)
@@ -58,16 +68,58 @@ class IngredientSerializer(serializers.ModelSerializer):
         )
 
 
+def get_in_bulk(field, queryset, pks):
+    """Объекты queryset по списку pks в том же порядке одним запросом"""
+    objects = queryset.in_bulk(set(pks))
+    for pk in pks:
+        if pk not in objects:
+            field.fail('does_not_exist', pk_value=pk)
+    return [objects[pk] for pk in pks]
+
+
+class PrimaryKeyListField(serializers.ListField):
+    """Список первичных ключей queryset. Все объекты выбираются
+    одним запросом, а не по одному на элемент"""
+    child = serializers.IntegerField(min_value=1)
+    default_error_messages = {
+        'does_not_exist': 'Недопустимый первичный ключ "{pk_value}" - '
+                          'объект не существует.',
+    }
+
+    def __init__(self, queryset, **kwargs):
+        self.queryset = queryset
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        pks = super().to_internal_value(data)
+        return get_in_bulk(self, self.queryset, pks)
+
+
+class ItRListSerializer(serializers.ListSerializer):
+    """Ингредиенты рецепта: все id проверяются одним запросом"""
+    default_error_messages = PrimaryKeyListField.default_error_messages
+
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+        ingredients = get_in_bulk(
+            self,
+            Ingredient.objects.all(),
+            [item['id'] for item in items]
+        )
+        for item, ingredient in zip(items, ingredients):
+            item['id'] = ingredient
+        return items
+
+
 class ItRSerializer(serializers.ModelSerializer):
     """Сериализатор для модели IngredientToRecipe."""
 
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all()
-    )
+    id = serializers.IntegerField(min_value=1)
 
     class Meta:
         model = IngredientToRecipe
         fields = ('id', 'amount')
+        list_serializer_class = ItRListSerializer
 
 
 class FULLItRSerializer(serializers.ModelSerializer):
@@ -88,32 +140,48 @@ class FULLItRSerializer(serializers.ModelSerializer):
         )
 
 
-class RecipeGETSerializer(serializers.ModelSerializer):
-    """Сериализатор модели Recipe для GET-запросов"""
-    is_favorited = serializers.BooleanField(read_only=True)
-    is_in_shopping_cart = serializers.BooleanField(read_only=True)
+class RecipeGETSerializer(FragmentCacheMixin, serializers.ModelSerializer):
+    """Сериализатор модели Recipe для GET-запросов.
+    Представления рецептов кэшируются (см. fragments)"""
+    is_favorited = serializers.SerializerMethodField()
+    is_in_shopping_cart = serializers.SerializerMethodField()
     author = MyUserSerializer(read_only=True)
     ingredients = FULLItRSerializer(
         many=True,
         source='recipe'
     )
-    image = Base64ImageField()
+    image = RecipeImageField()
+    image_webp = RecipeImageField(
+        variant='webp',
+        context_key='image_webp_variant',
+        fallback=False
+    )
     tags = TagSerializer(many=True)
 
+    def get_is_favorited(self, obj):
+        return obj.id in get_user_members(self.context, 'favorites')
+
+    def get_is_in_shopping_cart(self, obj):
+        return obj.id in get_user_members(self.context, 'cart')
+
     class Meta:
         model = Recipe
+        list_serializer_class = FragmentListSerializer
         fields = (
             'id',
             'ingredients',
             'tags',
             'image',
+            'image_webp',
             'name',
             'text',
             'cooking_time',
             'is_favorited',
             'is_in_shopping_cart',
             'author',
-            'pub_date'
+            'pub_date',
+            'favorite_count',
+            'cart_count'
         )
 
 
@@ -121,32 +189,23 @@ class RecipeSerializer(serializers.ModelSerializer):
     """Сериализатор модели Recipe"""
     ingredients = ItRSerializer(many=True)
     image = Base64ImageField()
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(),
-        many=True,
-    )
+    tags = PrimaryKeyListField(queryset=Tag.objects.all())
     author = MyUserSerializer(read_only=True)
 
     def validate_ingredients(self, data):
-        ingredients = self.initial_data.get('ingredients')
-        unique_ings = []
-        for ingredient in ingredients:
-            name = ingredient.get('id')
-            amount = ingredient.get('amount')
-            if type(amount) is str:
-                if not amount.isdigit():
-                    raise serializers.ValidationError(
-                        'Колличество ингредиента должно быть числом!'
-                    )
-            if int(amount) < 1:
-                raise serializers.ValidationError(
-                    f'Не корректное количество для {name}'
-                )
-            if name in unique_ings:
-                raise serializers.ValidationError(
-                    'Ингредиенты повторяются!'
-                )
-            unique_ings.append(name)
+        ids = [ingredient['id'].id for ingredient in data]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError(
+                'Ингредиенты повторяются!'
+            )
+        wrong = {
+            ingredient['id'].name for ingredient in data
+            if ingredient['amount'] < 1
+        }
+        if wrong:
+            raise serializers.ValidationError(
+                f'Не корректное количество для {", ".join(sorted(wrong))}'
+            )
         return data
 
     def _create_ingredients(self, ingredients, recipe):
@@ -169,36 +228,97 @@ class RecipeSerializer(serializers.ModelSerializer):
                 'Не предоставлены необходимые данные:'
                 'проверьте поля tags и ingredients)'
             )
-        recipe = Recipe.objects.create(**validated_data)
+        recipe = Recipe.objects.create(
+            tags_mask=get_tags_mask(tags_data),
+            **validated_data
+        )
         recipe.tags.set(tags_data)
         self._create_ingredients(ingredients_data, recipe)
         return recipe
 
+    def _update_tags(self, instance, tags):
+        """Добавляет и убирает только изменившиеся теги"""
+        old_ids = set(instance.tags.values_list('id', flat=True))
+        new_ids = {tag.id for tag in tags}
+        if old_ids - new_ids:
+            instance.tags.remove(*(old_ids - new_ids))
+        if new_ids - old_ids:
+            instance.tags.add(*(new_ids - old_ids))
+        instance.tags_mask = get_tags_mask(tags)
+
+    def _update_ingredients(self, instance, ingredients):
+        """Добавляет, изменяет и удаляет только изменившиеся строки
+        состава и поправляет итоги корзин. Возвращает, был ли он изменен"""
+        rows = {
+            row.ingredient_id: row
+            for row in IngredientToRecipe.objects.filter(
+                recipe=instance
+            ).only('id', 'ingredient_id', 'amount')
+        }
+        old_amounts = {
+            ingredient_id: row.amount for ingredient_id, row in rows.items()
+        }
+        new_amounts = {
+            ingredient['id'].id: ingredient['amount']
+            for ingredient in ingredients
+        }
+        if new_amounts == old_amounts:
+            return False
+        to_update = []
+        for ingredient_id, amount in new_amounts.items():
+            row = rows.get(ingredient_id)
+            if row is not None and row.amount != amount:
+                row.amount = amount
+                to_update.append(row)
+        IngredientToRecipe.objects.filter(
+            id__in=[
+                row.id for ingredient_id, row in rows.items()
+                if ingredient_id not in new_amounts
+            ]
+        ).delete()
+        IngredientToRecipe.objects.bulk_update(to_update, ['amount'])
+        self._create_ingredients(
+            [
+                ingredient for ingredient in ingredients
+                if ingredient['id'].id not in rows
+            ],
+            instance
+        )
+        apply_recipe_change(instance.id, old_amounts, new_amounts)
+        return True
+
     @transaction.atomic
     def update(self, instance, validated_data):
-        try:
-            instance.image = validated_data.get('image', instance.image)
-            instance.name = validated_data.get('name', instance.name)
-            instance.text = validated_data.get('text', instance.text)
-            instance.cooking_time = validated_data.get(
-                'cooking_time', instance.cooking_time
-            )
-            instance.tags.clear()
-            instance.ingredients.clear()
-            tags_data = self.validated_data.get('tags')
-            instance.tags.set(tags_data)
-            IngredientToRecipe.objects.filter(recipe=instance).all().delete()
-            self._create_ingredients(
-                validated_data.get('ingredients'),
-                instance
-            )
-            instance.save()
-            return instance
-        except Exception:
-            raise KeyError(
-                'Не предоставлены необходимые данные',
-                'проверьте все поля формы'
+        """Записывает только изменившиеся поля, теги и строки состава"""
+        changed = [
+            field for field in ('name', 'text', 'cooking_time')
+            if field in validated_data
+            and validated_data[field] != getattr(instance, field)
+        ]
+        for field in changed:
+            setattr(instance, field, validated_data[field])
+        image = validated_data.get('image')
+        if image and not is_same_image(instance, image):
+            instance.image = image
+            changed.append('image')
+        tags = validated_data.get('tags')
+        if tags is not None:
+            old_mask = instance.tags_mask
+            self._update_tags(instance, tags)
+            if instance.tags_mask != old_mask:
+                changed.append('tags_mask')
+        ingredients_changed = (
+            'ingredients' in validated_data
+            and self._update_ingredients(
+                instance, validated_data['ingredients']
             )
+        )
+        if changed:
+            instance.save(update_fields=changed)
+        elif ingredients_changed:
+            # bulk-операции со строками состава не отправляют сигналов
+            bump_version_on_commit(RECIPE_VERSION.format(instance.id))
+        return instance
 
     def to_representation(self, obj):
         return RecipeGETSerializer(obj, context=self.context).data
@@ -253,3 +373,12 @@ class CartSerializer(serializers.ModelSerializer):
                 message='Этот рецепт уже в корзине'
             )
         ]
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетного добавления и удаления"""
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=RECIPES_BATCH_SIZE
+    )
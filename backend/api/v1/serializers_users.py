@@ -1,16 +1,31 @@
 from django.contrib.auth import get_user_model
 from djoser.serializers import UserCreateSerializer, UserSerializer
-from drf_extra_fields.fields import Base64ImageField
+from recipes.memberships import get_members
 from recipes.models import Recipe
 from rest_framework import serializers
 from rest_framework.validators import UniqueTogetherValidator
 from users.models import Subscription
 
+from .fields import RecipeImageField
+
 
 User = get_user_model()
 taboo_logins = ('me', 'admin', 'user')
 
 
+def get_user_members(context, kind):
+    """Множество kind пользователя запроса (см. recipes.memberships).
+    Хранится в общем контексте, поэтому вложенные и списочные
+    сериализаторы берут его из кэша один раз за запрос"""
+    if kind not in context:
+        request = context.get('request')
+        if not request or request.user.is_anonymous:
+            context[kind] = set()
+        else:
+            context[kind] = get_members(request.user.id, kind)
+    return context[kind]
+
+
 class MyUserSerializer(UserSerializer):
     """Сериализатор модели User"""
     is_subscribed = serializers.SerializerMethodField(read_only=True)
@@ -22,12 +37,15 @@ class MyUserSerializer(UserSerializer):
             )
         return data
 
+    def get_subscriptions(self):
+        """Множество id авторов, на которых подписан пользователь"""
+        return get_user_members(self.context, 'subscriptions')
+
     def get_is_subscribed(self, obj):
         request = self.context.get('request')
-        user = request.user
-        if not request or user.is_anonymous:
+        if not request or request.user.is_anonymous:
             return False
-        return Subscription.objects.filter(user=user, author=obj).exists()
+        return obj.id in self.get_subscriptions()
 
     class Meta:
         model = User
@@ -37,7 +55,7 @@ class MyUserSerializer(UserSerializer):
             'first_name',
             'last_name',
             'email',
-            'is_subscribed'
+            'is_subscribed',
         )
 
 
@@ -113,7 +131,7 @@ class FollowingSerializer(serializers.ModelSerializer):
 
 class FollowingShowRecipeSerializer(serializers.ModelSerializer):
     """Сериализатор для отображения рецептов автора у подписчика"""
-    image = Base64ImageField()
+    image = RecipeImageField(variant='thumbnail', context_key=None)
 
     class Meta:
         model = Recipe
@@ -132,24 +150,26 @@ class FollowingShowSerializer(MyUserSerializer):
     count_recipes = serializers.SerializerMethodField()
 
     def get_recipes(self, obj):
-        """Получаем рецепты автора"""
+        """Получаем рецепты автора.
+        Вьюсет подписок заранее выбирает их для всей страницы"""
         request = self.context.get('request')
-        limit = request.query_params.get('recipes_limit')
-        if limit:
-            return FollowingShowRecipeSerializer(
-                Recipe.objects.filter(author=obj)[:int(limit)],
-                context={'request': request},
-                many=True
-            ).data
+        recipes_by_author = self.context.get('recipes_by_author')
+        if recipes_by_author is not None:
+            recipes = recipes_by_author.get(obj.id, [])
+        else:
+            recipes = Recipe.objects.filter(author=obj)
+            limit = request.query_params.get('recipes_limit')
+            if limit and limit.isdigit():
+                recipes = recipes[:int(limit)]
         return FollowingShowRecipeSerializer(
-            Recipe.objects.filter(author=obj),
+            recipes,
             context={'request': request},
             many=True
         ).data
 
     def get_count_recipes(self, obj):
-        """Считаем количество рецептов"""
-        return obj.recipes.count()
+        """Количество рецептов хранится в счетчике пользователя"""
+        return obj.recipes_count
 
     class Meta:
         model = User
@@ -160,6 +180,7 @@ class FollowingShowSerializer(MyUserSerializer):
             'last_name',
             'email',
             'is_subscribed',
+            'recipes_count',
             'recipes',
             'count_recipes'
         )
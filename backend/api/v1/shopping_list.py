@@ -0,0 +1,111 @@
+"""Потоковая выгрузка списка покупок в txt, csv и json"""
+import csv
+import json
+
+from django.db.models import F
+from django.http import StreamingHttpResponse
+from recipes.models import ShoppingListItem
+from rest_framework.renderers import BaseRenderer
+
+CHUNK_SIZE = 500
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Рендерер-заглушка: выбирает формат выгрузки через
+    ?format= или Accept, сам ответ формирует экспортер"""
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False).encode(self.charset)
+
+
+class TxtRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CsvRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class JsonRenderer(ShoppingListRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+
+def get_shopping_list(user):
+    """Итоги корзины пользователя в неизменном от запуска
+    к запуску порядке"""
+    return ShoppingListItem.objects.filter(
+        user=user
+    ).values(
+        'ingredient__name',
+        'ingredient__measurement_unit'
+    ).annotate(
+        amount=F('total_amount')
+    ).order_by(
+        'ingredient__name',
+        'ingredient__measurement_unit'
+    ).iterator(chunk_size=CHUNK_SIZE)
+
+
+class Echo:
+    """Файлоподобный объект, возвращающий записанную строку"""
+
+    def write(self, value):
+        return value
+
+
+def export_txt(user, rows):
+    yield f'Список покупок для пользователя << {user.get_username()} >>\n'
+    for row in rows:
+        yield (f'- {row["ingredient__name"]}'
+               f' - {row["amount"]}'
+               f' ({row["ingredient__measurement_unit"]})\n')
+    yield '\n Приятных покупок!:)'
+
+
+def export_csv(user, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'amount', 'measurement_unit'))
+    for row in rows:
+        yield writer.writerow((
+            row['ingredient__name'],
+            row['amount'],
+            row['ingredient__measurement_unit']
+        ))
+
+
+def export_json(user, rows):
+    yield '['
+    separator = ''
+    for row in rows:
+        yield separator + json.dumps({
+            'name': row['ingredient__name'],
+            'amount': row['amount'],
+            'measurement_unit': row['ingredient__measurement_unit'],
+        }, ensure_ascii=False)
+        separator = ','
+    yield ']'
+
+
+EXPORTERS = {
+    'txt': export_txt,
+    'csv': export_csv,
+    'json': export_json,
+}
+RENDERERS = (TxtRenderer, CsvRenderer, JsonRenderer)
+
+
+def shopping_list_response(user, renderer):
+    """Потоковый ответ со списком покупок в формате renderer"""
+    content = EXPORTERS[renderer.format](user, get_shopping_list(user))
+    response = StreamingHttpResponse(
+        (chunk.encode(renderer.charset) for chunk in content),
+        content_type=f'{renderer.media_type}; charset={renderer.charset}'
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="shopping-list.{renderer.format}"'
+    )
+    return response
@@ -0,0 +1,110 @@
+"""Предсобранные снимки справочников для отдачи без обращения к БД"""
+import gzip
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from recipes.cache import get_version
+from rest_framework.renderers import JSONRenderer
+
+
+class Snapshot:
+    """Сериализованное содержимое справочника одной версии"""
+
+    def __init__(self, version, content):
+        self.version = version
+        self.content = content
+        self.gzipped = gzip.compress(content)
+        self.digest = hashlib.sha1(content).hexdigest()[:16]
+        self.built_at = time.monotonic()
+
+
+def accepts_gzip(request):
+    """Принимает ли клиент gzip по Accept-Encoding с учетом q=0"""
+    weights = {}
+    for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, *params = (part.strip() for part in coding.split(';'))
+        weight = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        if name:
+            weights[name.lower()] = weight
+    return weights.get('gzip', weights.get('*', 0.0)) > 0
+
+
+class ReferenceSnapshot:
+    """Снимок справочника в памяти процесса.
+    Пересобирается, когда сигналы меняют версию набора данных name,
+    и в любом случае не реже раза в REFERENCE_SNAPSHOT_TTL секунд"""
+
+    def __init__(self, name, queryset, serializer_class):
+        self.name = name
+        self.queryset = queryset
+        self.serializer_class = serializer_class
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def _is_current(self, snapshot, version):
+        return (
+            snapshot is not None
+            and snapshot.version == version
+            and time.monotonic() - snapshot.built_at
+            <= settings.REFERENCE_SNAPSHOT_TTL
+        )
+
+    def get(self):
+        """Актуальный снимок, при необходимости собирает его заново"""
+        version = get_version(self.name)
+        snapshot = self._snapshot
+        if not self._is_current(snapshot, version):
+            with self._lock:
+                snapshot = self._snapshot
+                if not self._is_current(snapshot, version):
+                    data = self.serializer_class(
+                        self.queryset.all(),
+                        many=True
+                    ).data
+                    snapshot = Snapshot(version, JSONRenderer().render(data))
+                    self._snapshot = snapshot
+        return snapshot
+
+    def _is_not_modified(self, request, etag):
+        etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        return '*' in etags or etag in etags
+
+    def response(self, request):
+        """Ответ со снимком: 304 для актуальной копии клиента,
+        иначе готовое (при поддержке клиентом - сжатое) тело.
+        Только ETag, без Last-Modified: версия снимка - не время
+        изменения содержимого, а If-Modified-Since с точностью до секунды
+        подтвердил бы клиенту устаревшую копию"""
+        snapshot = self.get()
+        use_gzip = accepts_gzip(request)
+        # ETag по содержимому: пересборка по TTL без смены версии
+        # не должна подтверждать клиенту устаревшую копию
+        etag = f'"{self.name}-{snapshot.digest}{"-gzip" if use_gzip else ""}"'
+        if self._is_not_modified(request, etag):
+            response = HttpResponseNotModified()
+        elif use_gzip:
+            response = HttpResponse(
+                snapshot.gzipped,
+                content_type='application/json'
+            )
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(
+                snapshot.content,
+                content_type='application/json'
+            )
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
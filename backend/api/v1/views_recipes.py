@@ -1,20 +1,33 @@
-from django.db.models import Exists, OuterRef, Sum
-from django.http import HttpResponse
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
-from recipes.models import (Favorite, Ingredient, IngredientToRecipe, Recipe,
+from recipes.cache import get_hit_rate
+from recipes.ingredient_search import ingredient_index
+from recipes.models import (Favorite, FeedItem, Ingredient, Recipe,
                             ShoppingCart, Tag)
+from recipes.relations import add_recipes, remove_recipes
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import SAFE_METHODS
 from rest_framework.response import Response
 
 from .filters import IngredientFilter, RecipeFilter
+from .fragments import FRAGMENTS
+from .pagination import CustomPagination, KeysetPagination
+from .parsers import RecipeMultiPartParser
 from .permissions import IsOwnerOrReadOnly
 from .serializers_recipes import (CartSerializer, IngredientSerializer,
-                                  RecipeGETSerializer, RecipeSerializer,
-                                  TagSerializer)
+                                  RecipeGETSerializer, RecipeIdsSerializer,
+                                  RecipeSerializer, TagSerializer)
 from .serializers_users import FollowingShowRecipeSerializer
+from .shopping_list import RENDERERS, shopping_list_response
+from .snapshots import ReferenceSnapshot
+
+ingredients_snapshot = ReferenceSnapshot(
+    'ingredients', Ingredient.objects.all(), IngredientSerializer
+)
+tags_snapshot = ReferenceSnapshot('tags', Tag.objects.all(), TagSerializer)
 
 
 class IngredientViewSet(viewsets.ModelViewSet):
@@ -27,6 +40,21 @@ class IngredientViewSet(viewsets.ModelViewSet):
     filter_class = IngredientFilter
     search_fields = ('^name', )
 
+    def list(self, request, *args, **kwargs):
+        """Поиск по началу названия (name) и нечеткий поиск (search)
+        обслуживаются индексом в памяти, полный список - снимком.
+        Пустые параметры, как и в фильтрах, не ограничивают список"""
+        search = request.query_params.get('search')
+        name = request.query_params.get('name')
+        if search:
+            ingredients = ingredient_index.fuzzy_search(search)
+        elif name:
+            ingredients = ingredient_index.search(name)
+        else:
+            return ingredients_snapshot.response(request)
+        serializer = self.get_serializer(ingredients, many=True)
+        return Response(serializer.data)
+
 
 class TagViewSet(viewsets.ModelViewSet):
     """Viewset для объектов модели Tag"""
@@ -35,46 +63,45 @@ class TagViewSet(viewsets.ModelViewSet):
     pagination_class = None
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
 
+    def list(self, request, *args, **kwargs):
+        """Список тегов отдается из снимка в памяти"""
+        return tags_snapshot.response(request)
+
 
 class RecipeViewSet(viewsets.ModelViewSet):
     """Viewset для объектов модели Recipe"""
     queryset = Recipe.objects.all()
     serializer_class = RecipeSerializer
     permission_classes = (IsOwnerOrReadOnly, )
+    parser_classes = (JSONParser, RecipeMultiPartParser)
+    pagination_class = CustomPagination
+    keyset_ordering = ('-pub_date', '-id')
     filter_backends = (DjangoFilterBackend, )
     filter_class = RecipeFilter
 
     def get_serializer_class(self):
         """Определяет какой сериализатор нужен
          (в зависимости от метода запроса)"""
-        if self.request.method in SAFE_METHODS == 'GET':
+        if self.request.method in SAFE_METHODS:
             return RecipeGETSerializer
         return RecipeSerializer
 
+    def get_serializer_context(self):
+        """В списке рецептов отдаются уменьшенные копии изображений"""
+        context = super().get_serializer_context()
+        if self.action in ('list', 'feed'):
+            context['image_variant'] = 'thumbnail'
+            context['image_webp_variant'] = 'thumbnail_webp'
+        return context
+
     def get_queryset(self):
-        queryset = Recipe.objects.select_related(
+        """Собирает рецепты с фиксированным числом запросов.
+        Ингредиенты и теги подгружаются сериализатором одним батчем
+        и только для рецептов, которых нет в кэше представлений,
+        флаги избранного и корзины берутся из множеств пользователя"""
+        return Recipe.objects.select_related(
            'author'
-        ).prefetch_related(
-            'ingredients',
-            'tags'
-        )
-        user = self.request.user
-        if user.is_authenticated:
-            queryset = queryset.annotate(
-                is_favorited=Exists(
-                    Favorite.objects.filter(
-                        user=user,
-                        recipe=OuterRef('pk')
-                    )
-                ),
-                is_in_shopping_cart=Exists(
-                    ShoppingCart.objects.filter(
-                        user=user,
-                        recipe=OuterRef('pk')
-                    )
-                )
-            )
-        return queryset
+        ).order_by(*self.keyset_ordering)
 
     def perform_create(self, serializer):
         """"Передает в поле author данные о пользователе"""
@@ -84,6 +111,46 @@ class RecipeViewSet(viewsets.ModelViewSet):
         """Удаляет объект класса рецепт"""
         instance.delete()
 
+    def toggle_recipe(self, model, pk, errors, represent):
+        """Добавляет рецепт pk (POST) или убирает его (DELETE)
+        одним запросом; повтор - ошибка 400, а не 500"""
+        user = self.request.user
+        if not str(pk).isdigit():
+            raise Http404
+        if self.request.method == 'POST':
+            recipe = get_object_or_404(Recipe, id=pk)
+            if add_recipes(model, user, [recipe.id]):
+                return Response(
+                    represent(recipe),
+                    status=status.HTTP_201_CREATED
+                )
+            error = errors[0]
+        elif remove_recipes(model, user, [int(pk)]):
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        else:
+            error = errors[1]
+        return Response(
+            {'errors': error},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    def toggle_recipes(self, model):
+        """Добавляет (POST) или убирает (DELETE) рецепты из списка
+        recipes одним запросом; уже добавленные и отсутствующие
+        рецепты пропускаются"""
+        serializer = RecipeIdsSerializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        if self.request.method == 'POST':
+            return Response(
+                {'added': add_recipes(model, self.request.user, recipe_ids)}
+            )
+        return Response(
+            {'removed': remove_recipes(
+                model, self.request.user, recipe_ids
+            )}
+        )
+
     @action(
             methods=['POST', 'DELETE'],
             detail=True,
@@ -93,21 +160,12 @@ class RecipeViewSet(viewsets.ModelViewSet):
     )
     def favorite(self, request, pk):
         """Для добавления/удаления в/из Избранное"""
-        if request.method == 'POST':
-            recipe = get_object_or_404(Recipe, id=pk)
-            Favorite.objects.create(
-                user=request.user,
-                recipe=recipe
-            )
-            serializer = FollowingShowRecipeSerializer(recipe)
-            return Response(
-                serializer.data,
-                status=status.HTTP_201_CREATED
-            )
-        if Favorite.objects.filter(user=request.user, recipe__id=pk).exists():
-            Favorite.objects.filter(user=request.user, recipe__id=pk).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        return Response(status=status.HTTP_400_BAD_REQUEST)
+        return self.toggle_recipe(
+            Favorite,
+            pk,
+            ('Рецепт уже есть в избранном', 'Рецепта нет в избранном'),
+            lambda recipe: FollowingShowRecipeSerializer(recipe).data
+        )
 
     @action(
             methods=['POST', 'DELETE'],
@@ -118,53 +176,89 @@ class RecipeViewSet(viewsets.ModelViewSet):
     )
     def cart(self, request, pk):
         """Для добавления/удаления в/из корзину"""
-        user = request.user
-        if request.method == 'POST':
-            recipe = get_object_or_404(Recipe, id=pk)
-            instance = ShoppingCart.objects.create(
-                user=user,
-                recipe=recipe
-            )
-            serializer = CartSerializer(instance)
-            return Response(
-                serializer.data,
-                status=status.HTTP_201_CREATED
-            )
-        if ShoppingCart.objects.filter(
-            user=user, recipe__id=pk
-        ).exists():
-            ShoppingCart.objects.filter(
-                user=user,
-                recipe__id=pk
-            ).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
-        return Response(status=status.HTTP_400_BAD_REQUEST)
+        return self.toggle_recipe(
+            ShoppingCart,
+            pk,
+            ('Рецепт уже есть в корзине', 'Рецепта нет в корзине'),
+            lambda recipe: CartSerializer(
+                ShoppingCart(user=request.user, recipe=recipe)
+            ).data
+        )
+
+    @action(
+            methods=['POST', 'DELETE'],
+            detail=False,
+            url_path='favorite',
+            url_name='favorite_batch',
+            permission_classes=[permissions.IsAuthenticated]
+    )
+    def favorite_batch(self, request):
+        """Добавление/удаление нескольких рецептов в/из Избранное"""
+        return self.toggle_recipes(Favorite)
+
+    @action(
+            methods=['POST', 'DELETE'],
+            detail=False,
+            url_path='shopping_cart',
+            url_name='shopping_cart_batch',
+            permission_classes=[permissions.IsAuthenticated]
+    )
+    def cart_batch(self, request):
+        """Добавление/удаление нескольких рецептов в/из корзину"""
+        return self.toggle_recipes(ShoppingCart)
 
     @action(
         methods=['GET'],
         detail=False,
         permission_classes=[permissions.IsAuthenticated]
     )
+    def feed(self, request):
+        """Лента рецептов авторов, на которых подписан пользователь.
+        Читается из предрассчитанной ленты по ключу (pub_date, id)"""
+        paginator = KeysetPagination(ordering=('-pub_date', '-recipe_id'))
+        items = paginator.paginate_queryset(
+            FeedItem.objects.filter(user=request.user).only(
+                'recipe_id', 'pub_date'
+            ),
+            request,
+            view=self
+        )
+        recipes = self.get_queryset().in_bulk(
+            [item.recipe_id for item in items]
+        )
+        serializer = self.get_serializer(
+            [
+                recipes[item.recipe_id] for item in items
+                if item.recipe_id in recipes
+            ],
+            many=True
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        permission_classes=[permissions.IsAuthenticated],
+        renderer_classes=RENDERERS
+    )
     def download_shopping_cart(self, request):
-        """Выгрузка списка покупок в .txt формате"""
-        user = request.user
-        ingredients = IngredientToRecipe.objects.filter(
-            recipe__shopping_cart_r__user=user
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(amount=Sum('amount'))
-        shopping_list = (
-            f'Список покупок для пользователя << {user.get_username()} >>\n'
+        """Потоковая выгрузка списка покупок в формате txt, csv или json"""
+        return shopping_list_response(
+            request.user,
+            request.accepted_renderer
+        )
+
+    @action(
+        methods=['GET'],
+        detail=False,
+        permission_classes=[permissions.IsAdminUser]
+    )
+    def cache_stats(self, request):
+        """Попадания в кэш представлений рецептов
+        (?reset=1 - обнулить счетчики)"""
+        hits, misses, hit_rate = get_hit_rate(
+            FRAGMENTS, reset='reset' in request.query_params
+        )
+        return Response(
+            {'hits': hits, 'misses': misses, 'hit_rate': hit_rate}
         )
-        shopping_list += '\n'.join([
-            f'- {ingredient["ingredient__name"]}'
-            f' - {ingredient["amount"]}'
-            f' ({ingredient["ingredient__measurement_unit"]})'
-            for ingredient in ingredients
-        ])
-        shopping_list += '\n\n Приятных покупок!:)'
-        filename = "shopping-list.txt"
-        response = HttpResponse(shopping_list, content_type="text/plain")
-        response["Content-Disposition"] = f"attachment; {filename}"
-        return response
@@ -1,8 +1,11 @@
 from api.v1.pagination import CustomPagination
 from django.contrib.auth import get_user_model
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
-from rest_framework import permissions, status
+from recipes.models import Recipe
+from rest_framework import permissions, serializers, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from users.models import Subscription
@@ -13,11 +16,52 @@ from .serializers_users import (FollowingSerializer, FollowingShowSerializer,
 User = get_user_model()
 
 
+def get_recipes_limit(request):
+    """Проверяет параметр recipes_limit из запроса"""
+    limit = request.query_params.get('recipes_limit')
+    if limit is None:
+        return None
+    if not limit.isdigit():
+        raise serializers.ValidationError(
+            {'recipes_limit': 'Значение должно быть целым числом >= 0'}
+        )
+    return int(limit)
+
+
+def get_recipes_by_author(authors, limit=None):
+    """Одним запросом выбирает не более limit последних рецептов
+    для каждого автора (ROW_NUMBER с разбиением по автору)"""
+    if not authors:
+        return {}
+    recipes = Recipe.objects.filter(author__in=authors)
+    if limit is not None:
+        ranked = recipes.annotate(
+            recipe_rank=Window(
+                expression=RowNumber(),
+                partition_by=F('author_id'),
+                order_by=(F('pub_date').desc(), F('id').desc())
+            )
+        ).order_by()
+        sql, params = ranked.query.sql_with_params()
+        recipes = Recipe.objects.raw(
+            f'SELECT * FROM ({sql}) ranked '
+            f'WHERE recipe_rank <= %s ORDER BY recipe_rank',
+            (*params, limit)
+        )
+    else:
+        recipes = recipes.order_by('-pub_date', '-id')
+    recipes_by_author = {author.id: [] for author in authors}
+    for recipe in recipes:
+        recipes_by_author[recipe.author_id].append(recipe)
+    return recipes_by_author
+
+
 class UsersViewSet(UserViewSet):
     """Viewset для объектов модели User"""
-    queryset = User.objects.all()
+    queryset = User.objects.order_by('id')
     serializer_class = MyUserSerializer
     pagination_class = CustomPagination
+    keyset_ordering = ('id',)
     permission_classes = (permissions.IsAuthenticatedOrReadOnly, )
 
     @action(
@@ -63,11 +107,17 @@ class UsersViewSet(UserViewSet):
     def subscriptions(self, request):
         """Выдает авторов, на кого подписан пользователь"""
         user = request.user
-        queryset = User.objects.filter(following__user=user)
+        limit = get_recipes_limit(request)
+        queryset = User.objects.filter(following__user=user).order_by('id')
         result_pages = self.paginate_queryset(queryset)
         serializer = FollowingShowSerializer(
             result_pages,
-            context={'request': request},
+            context={
+                'request': request,
+                'recipes_by_author': get_recipes_by_author(
+                    result_pages, limit
+                ),
+            },
             many=True
         )
         return self.get_paginated_response(serializer.data)
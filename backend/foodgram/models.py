@@ -0,0 +1,22 @@
+"""Общие для приложений примеси моделей"""
+
+
+class UpdateOnlyFieldsMixin:
+    """Полное сохранение существующего объекта не записывает поля
+    update_only_fields. Их меняют атомарные UPDATE (счетчики с F(),
+    фоновые задачи), и значения из устаревшего экземпляра затерли бы
+    параллельные изменения"""
+    update_only_fields = ()
+
+    def save(self, *args, **kwargs):
+        if (not args and kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')
+                and not self._state.adding):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.update_only_fields
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
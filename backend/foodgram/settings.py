@@ -74,6 +74,25 @@ DATABASES = {
     }
 }
 
+# Кэш общий для всех процессов: версии наборов данных в нем
+# сбрасывают кэши в памяти каждого воркера
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.memcached.PyMemcacheCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'memcached:11211'),
+    }
+}
+if CACHES['default']['BACKEND'].endswith('PyMemcacheCache'):
+    # Недоступный memcached - промах кэша, а не ошибка запроса
+    CACHES['default']['OPTIONS'] = {
+        'ignore_exc': True,
+        'connect_timeout': 0.5,
+        'timeout': 0.5,
+    }
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -93,7 +112,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.v1.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
@@ -138,3 +157,26 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 LIST_PER_PAGE: int = 10
 TEXT_SL: int = 15
+TAG_MASK_BITS: int = 63
+INGREDIENT_SEARCH_LIMIT: int = 20
+INGREDIENT_INDEX_TTL: int = 300
+REFERENCE_SNAPSHOT_TTL: int = 300
+INGREDIENT_FUZZY_THRESHOLD: float = 0.3
+
+IMAGE_WORKERS: int = 2
+IMAGE_VARIANTS: dict = {
+    'thumbnail': {'size': (640, 360), 'format': 'JPEG', 'crop': True},
+    'thumbnail_webp': {'size': (640, 360), 'format': 'WEBP', 'crop': True},
+    'webp': {'size': (1920, 1080), 'format': 'WEBP', 'crop': False},
+}
+IMAGE_QUALITY: int = 80
+RECIPE_IMAGE_MAX_SIZE: int = 10 * 1024 ** 2
+FEED_BACKFILL_SIZE: int = 100
+COUNT_CACHE_TTL: int = 60
+COUNT_ESTIMATE_THRESHOLD: int = 10000
+RECIPE_SEARCH_CONFIG: str = 'russian'
+RECIPE_FRAGMENT_TTL: int = 5 * 60
+MEMBERSHIP_TTL: int = 60 * 60
+RECIPES_BATCH_SIZE: int = 100
+TOKEN_CACHE_SIZE: int = 10000
+TOKEN_CACHE_TTL: int = 60
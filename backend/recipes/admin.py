@@ -2,7 +2,8 @@ from django.contrib import admin
 from foodgram.settings import LIST_PER_PAGE
 
 from .models import (Favorite, Ingredient, IngredientToRecipe, Recipe,
-                     ShoppingCart, Tag)
+                     ShoppingCart, ShoppingListItem, Tag)
+from .tag_masks import update_tags_mask
 
 
 @admin.register(Tag)
@@ -11,7 +12,8 @@ class TagAdmin(admin.ModelAdmin):
         'pk',
         'name',
         'color',
-        'slug'
+        'slug',
+        'bit',
     )
     empty_value_display = '<--пусто-->'
     list_filter = ('name', 'slug',)
@@ -42,8 +44,8 @@ class RecipeAdmin(admin.ModelAdmin):
         'cooking_time',
         'author',
         'pub_date',
-        'cnt_favorite',
-
+        'favorite_count',
+        'cart_count',
     )
     empty_value_display = '<--пусто-->'
     list_filter = (
@@ -58,10 +60,11 @@ class RecipeAdmin(admin.ModelAdmin):
     )
     ordering = ('-pub_date',)
     list_per_page = LIST_PER_PAGE
+    readonly_fields = ('favorite_count', 'cart_count', 'tags_mask',)
 
-    @admin.display(description='В избранном')
-    def cnt_favorite(self, obj):
-        return obj.favorite.count()
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        update_tags_mask(form.instance)
 
 
 @admin.register(IngredientToRecipe)
@@ -109,3 +112,18 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     list_filter = ('user', 'recipe',)
     search_fields = ('user', 'recipe',)
     list_per_page = LIST_PER_PAGE
+
+
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = (
+        'pk',
+        'user',
+        'ingredient',
+        'total_amount'
+    )
+    empty_value_display = '<--пусто-->'
+    list_filter = ('user',)
+    search_fields = ('user__email', 'ingredient__name',)
+    list_select_related = ('user', 'ingredient')
+    list_per_page = LIST_PER_PAGE
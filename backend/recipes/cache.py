@@ -0,0 +1,70 @@
+"""Версии справочных данных для инвалидации кэшей в памяти процессов"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'version:{}'
+STATS_KEY = 'stats:{}:{}'
+RECIPE_VERSION = 'recipe:{}'
+USER_VERSION = 'user:{}'
+
+
+def get_version(name):
+    """Текущая версия набора данных name"""
+    key = VERSION_KEY.format(name)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(name):
+    """Помечает набор данных name как изменившийся"""
+    cache.set(VERSION_KEY.format(name), time.time_ns(), None)
+
+
+def get_versions(names):
+    """Текущие версии нескольких наборов данных одним обращением"""
+    keys = {VERSION_KEY.format(name): name for name in names}
+    versions = cache.get_many(keys)
+    for key in keys.keys() - versions.keys():
+        versions[key] = get_version(keys[key])
+    return [versions[key] for key in keys]
+
+
+def bump_table_version(sender, action=None, **kwargs):
+    """Обработчик сигналов: помечает таблицу модели sender измененной.
+    Для m2m_changed учитываются только завершенные (post_) действия"""
+    if action is None or action.startswith('post_'):
+        bump_version(f'table:{sender._meta.db_table}')
+
+
+def bump_version_on_commit(name):
+    """bump_version после фиксации транзакции, чтобы параллельный запрос
+    не закэшировал незафиксированные данные под новой версией"""
+    transaction.on_commit(lambda: bump_version(name))
+
+
+def count_hits(name, hits, misses):
+    """Копит число попаданий и промахов кэша name"""
+    for kind, delta in (('hits', hits), ('misses', misses)):
+        if delta:
+            key = STATS_KEY.format(name, kind)
+            cache.add(key, 0, None)
+            try:
+                cache.incr(key, delta)
+            except ValueError:
+                cache.set(key, delta, None)
+
+
+def get_hit_rate(name, reset=False):
+    """Попадания, промахи и доля попаданий кэша name"""
+    keys = [STATS_KEY.format(name, kind) for kind in ('hits', 'misses')]
+    stats = cache.get_many(keys)
+    if reset:
+        cache.delete_many(keys)
+    hits, misses = (stats.get(key, 0) for key in keys)
+    total = hits + misses
+    return hits, misses, hits / total if total else 0.0
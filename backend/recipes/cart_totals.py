@@ -0,0 +1,117 @@
+"""Поддержка таблицы итогов корзины (ShoppingListItem)"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Sum
+
+from .models import IngredientToRecipe, ShoppingCart, ShoppingListItem
+
+
+def get_recipe_amounts(recipe_id):
+    """Количество каждого ингредиента в рецепте"""
+    return dict(
+        IngredientToRecipe.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('ingredient_id', 'amount')
+    )
+
+
+@transaction.atomic
+def apply_amounts(user_ids, deltas):
+    """Прибавляет deltas {ingredient_id: количество} к итогам
+    корзин пользователей user_ids. Недостающие строки сначала
+    вставляются с нулем без ошибок на конфликтах (их могла вставить
+    параллельная транзакция), затем все строки блокируются в одном
+    порядке и пересчитываются"""
+    deltas = {key: value for key, value in deltas.items() if value}
+    user_ids = list(user_ids)
+    if not deltas or not user_ids:
+        return
+    items = ShoppingListItem.objects.filter(
+        user_id__in=user_ids,
+        ingredient_id__in=deltas
+    )
+    existing = set(items.values_list('user_id', 'ingredient_id'))
+    ShoppingListItem.objects.bulk_create(
+        (
+            ShoppingListItem(
+                user_id=user_id, ingredient_id=ingredient_id, total_amount=0
+            )
+            for user_id in user_ids
+            for ingredient_id, delta in deltas.items()
+            if delta > 0 and (user_id, ingredient_id) not in existing
+        ),
+        ignore_conflicts=True
+    )
+    to_update, to_delete = [], []
+    for item in items.select_for_update().order_by('user_id', 'ingredient_id'):
+        item.total_amount += deltas[item.ingredient_id]
+        if item.total_amount > 0:
+            to_update.append(item)
+        else:
+            to_delete.append(item.id)
+    ShoppingListItem.objects.bulk_update(to_update, ['total_amount'])
+    ShoppingListItem.objects.filter(id__in=to_delete).delete()
+
+
+def apply_recipe(user_ids, recipe_id, sign=1):
+    """Добавляет (sign=1) или убирает (sign=-1) рецепт из итогов"""
+    apply_amounts(user_ids, {
+        ingredient_id: sign * amount
+        for ingredient_id, amount in get_recipe_amounts(recipe_id).items()
+    })
+
+
+def apply_recipe_change(recipe_id, old_amounts, new_amounts):
+    """Переносит изменение состава рецепта в итоги всех корзин с ним"""
+    deltas = Counter(new_amounts)
+    deltas.subtract(old_amounts)
+    apply_amounts(
+        ShoppingCart.objects.filter(
+            recipe_id=recipe_id
+        ).values_list('user_id', flat=True),
+        deltas
+    )
+
+
+def get_expected_totals():
+    """Итоги корзин, посчитанные заново по исходным таблицам"""
+    return {
+        (row['recipe__shopping_cart_r__user'], row['ingredient']):
+            row['total_amount']
+        for row in IngredientToRecipe.objects.filter(
+            recipe__shopping_cart_r__isnull=False
+        ).values(
+            'recipe__shopping_cart_r__user',
+            'ingredient'
+        ).annotate(total_amount=Sum('amount')).order_by()
+    }
+
+
+@transaction.atomic
+def rebuild_totals(dry_run=False):
+    """Сверяет таблицу итогов с исходными данными и исправляет
+    расхождения. Возвращает число добавленных, исправленных
+    и удаленных строк"""
+    expected = get_expected_totals()
+    to_create, to_update, to_delete = [], [], []
+    for item in ShoppingListItem.objects.select_for_update():
+        total_amount = expected.pop((item.user_id, item.ingredient_id), None)
+        if total_amount is None:
+            to_delete.append(item.id)
+        elif total_amount != item.total_amount:
+            item.total_amount = total_amount
+            to_update.append(item)
+    to_create = [
+        ShoppingListItem(
+            user_id=user_id,
+            ingredient_id=ingredient_id,
+            total_amount=total_amount
+        )
+        for (user_id, ingredient_id), total_amount in expected.items()
+    ]
+    if not dry_run:
+        ShoppingListItem.objects.bulk_create(to_create)
+        ShoppingListItem.objects.bulk_update(to_update, ['total_amount'])
+        ShoppingListItem.objects.filter(id__in=to_delete).delete()
+    return len(to_create), len(to_update), len(to_delete)
@@ -0,0 +1,57 @@
+"""Денормализованные счетчики рецептов и пользователей"""
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from users.models import Subscription
+
+from .models import Favorite, Recipe, ShoppingCart
+
+User = get_user_model()
+
+# (модель со счетчиком, поле счетчика, считаемая модель, ссылка на модель)
+COUNTERS = (
+    (Recipe, 'favorite_count', Favorite, 'recipe'),
+    (Recipe, 'cart_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Subscription, 'author'),
+)
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно изменяет счетчик на delta, не опуская его ниже нуля"""
+    queryset = model.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def actual_count(related_model, link):
+    """Подзапрос с фактическим числом связанных строк"""
+    return Coalesce(
+        Subquery(
+            related_model.objects.filter(
+                **{link: OuterRef('pk')}
+            ).order_by().values(link).annotate(
+                count=Count('pk')
+            ).values('count')
+        ),
+        0
+    )
+
+
+def reconcile_counters(dry_run=False):
+    """Сверяет счетчики с фактическими данными и исправляет их.
+    Возвращает число расхождений по каждому счетчику"""
+    drift = {}
+    for model, field, related_model, link in COUNTERS:
+        drifted = list(
+            model.objects.annotate(
+                actual=actual_count(related_model, link)
+            ).exclude(**{field: F('actual')}).values_list('pk', flat=True)
+        )
+        drift[f'{model.__name__}.{field}'] = len(drifted)
+        if drifted and not dry_run:
+            model.objects.filter(pk__in=drifted).update(
+                **{field: actual_count(related_model, link)}
+            )
+    return drift
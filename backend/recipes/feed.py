@@ -0,0 +1,63 @@
+"""Лента подписок с раздачей при записи (fan-out on write)"""
+from django.conf import settings
+from django.db import transaction
+from users.models import Subscription
+
+from .models import FeedItem, Recipe
+
+BATCH_SIZE = 1000
+
+
+def publish(recipe):
+    """Раскладывает новый рецепт в ленты подписчиков автора"""
+    followers = Subscription.objects.filter(
+        author_id=recipe.author_id
+    ).values_list('user_id', flat=True)
+    FeedItem.objects.bulk_create(
+        (
+            FeedItem(
+                user_id=user_id,
+                recipe_id=recipe.id,
+                author_id=recipe.author_id,
+                pub_date=recipe.pub_date
+            )
+            for user_id in followers.iterator()
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту последние рецепты автора после подписки"""
+    recipes = Recipe.objects.filter(
+        author_id=author_id
+    ).order_by('-pub_date', '-id').values_list(
+        'id', 'pub_date'
+    )[:settings.FEED_BACKFILL_SIZE]
+    FeedItem.objects.bulk_create(
+        [
+            FeedItem(
+                user_id=user_id,
+                recipe_id=recipe_id,
+                author_id=author_id,
+                pub_date=pub_date
+            )
+            for recipe_id, pub_date in recipes
+        ],
+        ignore_conflicts=True
+    )
+
+
+def trim(user_id, author_id):
+    """Убирает рецепты автора из ленты после отписки"""
+    FeedItem.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+@transaction.atomic
+def rebuild_feeds():
+    """Пересобирает все ленты по текущим подпискам"""
+    FeedItem.objects.all().delete()
+    subscriptions = Subscription.objects.values_list('user_id', 'author_id')
+    for user_id, author_id in subscriptions.iterator():
+        backfill(user_id, author_id)
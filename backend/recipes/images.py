@@ -0,0 +1,194 @@
+"""Уменьшенные копии и WebP-варианты изображений рецептов.
+Создаются в пуле потоков после фиксации транзакции.
+Файлы изображений общие для рецептов с одинаковым содержимым
+(см. ContentAddressedStorage) и удаляются, когда на них
+не остается ссылок"""
+import hashlib
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+from .cache import RECIPE_VERSION, bump_version
+from .models import Recipe
+from .storage import ContentAddressedStorage, lock_name
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp'}
+
+image_storage = Recipe._meta.get_field('image').storage
+
+executor = ThreadPoolExecutor(
+    max_workers=max(settings.IMAGE_WORKERS, 1),
+    thread_name_prefix='recipe-images'
+)
+
+
+def get_variant(recipe, variant):
+    """Имя файла готового варианта изображения рецепта или None"""
+    if not has_current_variants(recipe):
+        return None
+    return recipe.image_variants.get(variant)
+
+
+def variant_name(source_name, variant, options):
+    """Путь к варианту рядом с исходником:
+    images/variants/<имя>_<вариант>_<хэш настроек>. Хэш настроек в имени
+    позволяет отдавать варианты как неизменяемые: после смены
+    IMAGE_VARIANTS или IMAGE_QUALITY у варианта будет другое имя"""
+    directory, filename = os.path.split(source_name)
+    stem = os.path.splitext(filename)[0]
+    spec = hashlib.sha256(json.dumps([
+        options['size'], options['format'], options['crop'],
+        settings.IMAGE_QUALITY
+    ]).encode()).hexdigest()[:8]
+    return os.path.join(
+        directory, 'variants',
+        f'{stem}_{variant}_{spec}.{EXTENSIONS[options["format"]]}'
+    )
+
+
+def current_variants(source_name):
+    """image_variants, которые должны быть у изображения source_name
+    при текущих настройках"""
+    return {
+        'source': source_name,
+        **{
+            variant: variant_name(source_name, variant, options)
+            for variant, options in settings.IMAGE_VARIANTS.items()
+        }
+    }
+
+
+def has_current_variants(recipe):
+    """Созданы ли варианты текущего изображения по текущим настройкам"""
+    return bool(recipe.image) and (
+        recipe.image_variants == current_variants(recipe.image.name)
+    )
+
+
+def render_variant(image, size, image_format, crop):
+    """Масштабирует изображение и кодирует его в image_format"""
+    if crop:
+        image = ImageOps.fit(image, size, Image.Resampling.LANCZOS)
+    else:
+        image = image.copy()
+        image.thumbnail(size, Image.Resampling.LANCZOS)
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(
+        buffer, image_format,
+        quality=settings.IMAGE_QUALITY,
+        optimize=image_format == 'JPEG'
+    )
+    return buffer.getvalue()
+
+
+def make_variants(recipe_id, source_name):
+    """Создает все варианты для изображения source_name рецепта.
+    Имена вариантов выводятся из имени исходника, поэтому рецепты
+    с одинаковым изображением переиспользуют одни и те же файлы"""
+    variants = current_variants(source_name)
+    image = None
+    for variant, options in settings.IMAGE_VARIANTS.items():
+        name = variants[variant]
+        if not default_storage.exists(name):
+            if image is None:
+                with image_storage.open(source_name) as file:
+                    image = ImageOps.exif_transpose(Image.open(file))
+                    image.load()
+            default_storage.save(name, ContentFile(render_variant(
+                image, options['size'], options['format'], options['crop']
+            )))
+    updated = Recipe.objects.filter(pk=recipe_id, image=source_name).update(
+        image_variants=variants
+    )
+    if updated:
+        bump_version(RECIPE_VERSION.format(recipe_id))
+    else:
+        release_image(source_name)
+
+
+def is_same_image(recipe, content):
+    """Совпадает ли загруженный файл с текущим изображением рецепта.
+    Хранилище называет файлы по содержимому, поэтому достаточно
+    сравнить имена"""
+    if not recipe.image or not isinstance(
+        image_storage, ContentAddressedStorage
+    ):
+        return False
+    field = recipe._meta.get_field('image')
+    return image_storage.content_name(
+        field.generate_filename(recipe, content.name), content
+    ) == recipe.image.name
+
+
+def release_image(name):
+    """Удаляет изображение и его варианты, если на него
+    больше не ссылается ни один рецепт. Ссылки проверяются под той же
+    блокировкой имени, что и загрузка (см. lock_name): параллельная
+    загрузка того же содержимого либо уже зафиксирована и видна здесь,
+    либо дождется удаления и запишет файл заново"""
+    if not name:
+        return
+    with transaction.atomic():
+        lock_name(name)
+        if Recipe.objects.filter(image=name).exists():
+            return
+        image_storage.delete(name)
+        # Варианты по любым прежним настройкам: <имя>_<вариант>[_<хэш>]
+        directory, filename = os.path.split(name)
+        directory = os.path.join(directory, 'variants')
+        pattern = re.compile(
+            re.escape(os.path.splitext(filename)[0])
+            + '_(' + '|'.join(map(re.escape, settings.IMAGE_VARIANTS))
+            + r')(_[0-9a-f]{8})?\.\w+'
+        )
+        if default_storage.exists(directory):
+            for variant in default_storage.listdir(directory)[1]:
+                if pattern.fullmatch(variant):
+                    default_storage.delete(os.path.join(directory, variant))
+
+
+def schedule_release(name):
+    """Освобождает изображение после фиксации транзакции"""
+    if name:
+        transaction.on_commit(lambda: release_image(name))
+
+
+def run_make_variants(recipe_id, source_name):
+    try:
+        make_variants(recipe_id, source_name)
+    except Exception:
+        logger.exception(
+            'Не удалось создать варианты изображения %s', source_name
+        )
+    finally:
+        if settings.IMAGE_WORKERS:
+            connections.close_all()
+
+
+def schedule_variants(recipe):
+    """Ставит создание вариантов в очередь после фиксации транзакции.
+    При IMAGE_WORKERS = 0 варианты создаются в текущем потоке"""
+    if not recipe.image or has_current_variants(recipe):
+        return
+    recipe_id, source_name = recipe.id, recipe.image.name
+
+    def submit():
+        if settings.IMAGE_WORKERS:
+            executor.submit(run_make_variants, recipe_id, source_name)
+        else:
+            run_make_variants(recipe_id, source_name)
+
+    transaction.on_commit(submit)
@@ -0,0 +1,108 @@
+"""Поиск ингредиентов в памяти процесса без обращения к БД"""
+import heapq
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+from .cache import get_version
+from .models import Ingredient
+
+
+def normalize(value):
+    """Приводит название к виду для сравнения: регистр и ё/е"""
+    return value.strip().casefold().replace('ё', 'е')
+
+
+def trigrams(value):
+    """Множество триграмм нормализованной строки с отбивкой пробелами"""
+    padded = f'  {value} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class IngredientIndex:
+    """Индекс ингредиентов, отсортированный по нормализованному названию,
+    с инвертированным триграммным индексом для нечеткого поиска.
+    Перестраивается при смене версии справочника или по истечении
+    INGREDIENT_INDEX_TTL секунд"""
+
+    def __init__(self):
+        self._data = ([], [], {}, [])
+        self._version = None
+        self._built_at = None
+        self._lock = threading.Lock()
+
+    def _is_stale(self):
+        return (
+            self._built_at is None
+            or self._version != get_version('ingredients')
+            or time.monotonic() - self._built_at
+            > settings.INGREDIENT_INDEX_TTL
+        )
+
+    def build(self):
+        """Загружает справочник из БД и строит индекс"""
+        version = get_version('ingredients')
+        ingredients = sorted(
+            Ingredient.objects.all(),
+            key=lambda ingredient: (normalize(ingredient.name), ingredient.id)
+        )
+        keys = [normalize(ingredient.name) for ingredient in ingredients]
+        postings = defaultdict(list)
+        sizes = []
+        for position, key in enumerate(keys):
+            key_trigrams = trigrams(key)
+            sizes.append(len(key_trigrams))
+            for trigram in key_trigrams:
+                postings[trigram].append(position)
+        self._data = (keys, ingredients, dict(postings), sizes)
+        self._version = version
+        self._built_at = time.monotonic()
+
+    def refresh(self):
+        """Перестраивает индекс, если он устарел"""
+        if self._is_stale():
+            with self._lock:
+                if self._is_stale():
+                    self.build()
+
+    def search(self, prefix, limit=None):
+        """Ингредиенты, название которых начинается с prefix"""
+        self.refresh()
+        keys, ingredients, _, _ = self._data
+        prefix = normalize(prefix)
+        limit = limit or settings.INGREDIENT_SEARCH_LIMIT
+        start = bisect_left(keys, prefix)
+        end = bisect_left(keys, prefix + '\uffff', lo=start)
+        return ingredients[start:min(end, start + limit)]
+
+    def fuzzy_search(self, query, limit=None):
+        """Ингредиенты, похожие на query, по убыванию сходства.
+        Сходство - коэффициент Дайса по триграммам, совпадение
+        по началу названия поднимает результат выше"""
+        self.refresh()
+        keys, ingredients, postings, sizes = self._data
+        query = normalize(query)
+        if not query:
+            return []
+        limit = limit or settings.INGREDIENT_SEARCH_LIMIT
+        query_trigrams = trigrams(query)
+        common = Counter()
+        for trigram in query_trigrams:
+            common.update(postings.get(trigram, ()))
+        scored = []
+        for position, hits in common.items():
+            score = 2 * hits / (len(query_trigrams) + sizes[position])
+            if keys[position].startswith(query):
+                score += 1
+            if score >= settings.INGREDIENT_FUZZY_THRESHOLD:
+                scored.append((score, -len(keys[position]), -position))
+        return [
+            ingredients[-position]
+            for _, _, position in heapq.nlargest(limit, scored)
+        ]
+
+
+ingredient_index = IngredientIndex()
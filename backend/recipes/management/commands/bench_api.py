@@ -0,0 +1,583 @@
+import itertools
+import json
+import math
+import platform
+import random
+import time
+import tracemalloc
+from datetime import datetime
+from urllib.parse import quote
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from recipes.cache import bump_table_version, bump_version
+from recipes.cart_totals import rebuild_totals
+from recipes.counters import reconcile_counters
+from recipes.feed import rebuild_feeds
+from recipes.models import (FeedItem, Favorite, Ingredient, IngredientToRecipe,
+                            Recipe, ShoppingCart, ShoppingListItem, Tag)
+from recipes.tag_masks import get_tags_mask
+from rest_framework.authtoken.models import Token
+from users.models import Subscription
+
+User = get_user_model()
+
+# Популярность авторов, рецептов и ингредиентов убывает по закону Ципфа
+ZIPF_EXPONENT = 1.1
+AUTHORS_SHARE = 0.2
+TAGS_PER_RECIPE = (1, 3)
+INGREDIENTS_PER_RECIPE = (3, 12)
+SEEDED_MODELS = (
+    User, Token, Subscription, Ingredient, Tag, Recipe, Recipe.tags.through,
+    IngredientToRecipe, Favorite, ShoppingCart, ShoppingListItem, FeedItem,
+)
+# Удаление идет через сигналы, поэтому объекты загружаются в память:
+# по DELETE_BATCH_SIZE рецептов или пользователей за раз
+DELETE_BATCH_SIZE = 500
+
+
+def zipf_cum_weights(size):
+    """Накопленные веса для random.choices: k-й элемент в k^s раз
+    популярнее первого"""
+    return list(itertools.accumulate(
+        1 / (rank + 1) ** ZIPF_EXPONENT for rank in range(size)
+    ))
+
+
+def shuffled(values):
+    """Копия values в случайном порядке, чтобы популярность
+    не зависела от id"""
+    values = list(values)
+    random.shuffle(values)
+    return values
+
+
+def pick(population, cum_weights, count):
+    """До count различных элементов с учетом популярности"""
+    return list(dict.fromkeys(
+        random.choices(population, cum_weights=cum_weights, k=count)
+    ))
+
+
+def percentile(values, share):
+    """Перцентиль по ближайшему рангу для отсортированного values"""
+    return values[max(0, math.ceil(share * len(values)) - 1)]
+
+
+def even(count):
+    """Четное число запросов: пары POST/DELETE возвращают данные
+    в исходное состояние"""
+    return count + count % 2
+
+
+def read_response(response):
+    """Дочитывает потоковый ответ, чтобы замер включал его генерацию"""
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+
+
+class Command(BaseCommand):
+    help = ('Seed a synthetic dataset and benchmark every API route '
+            'in-process: latency percentiles, throughput, SQL queries '
+            'and peak memory, saved as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=1000,
+            help='How many users to generate'
+        )
+        parser.add_argument(
+            '--recipes', type=int, default=10000,
+            help='How many recipes to generate (10k to 1M)'
+        )
+        parser.add_argument(
+            '--subscriptions', type=int, default=10,
+            help='Average subscriptions per user'
+        )
+        parser.add_argument(
+            '--favorites', type=int, default=20,
+            help='Average favorite recipes per user'
+        )
+        parser.add_argument(
+            '--cart', type=int, default=5,
+            help='Average shopping cart recipes per user'
+        )
+        parser.add_argument(
+            '--requests', type=int, default=100,
+            help='Measured requests per endpoint'
+        )
+        parser.add_argument(
+            '--warmup', type=int, default=10,
+            help='Unmeasured requests per endpoint before measuring'
+        )
+        parser.add_argument(
+            '--memory-requests', type=int, default=3,
+            help='Requests per endpoint traced for peak memory'
+        )
+        parser.add_argument(
+            '--clients', type=int, default=20,
+            help='How many users send authenticated requests'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Rows per INSERT statement'
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Random seed for a reproducible dataset'
+        )
+        parser.add_argument(
+            '--no-seed', action='store_true',
+            help='Benchmark the data already in the DB'
+        )
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='Keep generated data and tokens (by default they are '
+                 'deleted after measuring)'
+        )
+        parser.add_argument(
+            '--output', default='bench_api.json',
+            help='Where to save the JSON report'
+        )
+        parser.add_argument(
+            '--compare',
+            help='Previous JSON report to compare p95 latency with'
+        )
+
+    def _bulk_create(self, model, objects, batch_size):
+        """bulk_create по частям; возвращает id созданных строк
+        даже там, где БД не возвращает их из INSERT"""
+        ids = []
+        objects = iter(objects)
+        while True:
+            batch = list(itertools.islice(objects, batch_size))
+            if not batch:
+                return ids
+            last_id = model.objects.order_by('-pk').values_list(
+                'pk', flat=True
+            ).first() or 0
+            created = model.objects.bulk_create(batch)
+            if created[0].pk is None:
+                ids.extend(
+                    model.objects.filter(pk__gt=last_id).order_by(
+                        'pk'
+                    ).values_list('pk', flat=True)[:len(batch)]
+                )
+            else:
+                ids.extend(instance.pk for instance in created)
+
+    def _seed_users(self, options):
+        prefix = self.prefix = f'bench{time.time_ns()}'
+        user_ids = self._bulk_create(
+            User,
+            (
+                User(
+                    username=f'{prefix}_{number}',
+                    email=f'{prefix}_{number}@example.com',
+                    first_name='Бенчмарк', last_name=str(number),
+                    password='!'
+                )
+                for number in range(options['users'])
+            ),
+            options['batch_size']
+        )
+        authors = user_ids[:max(1, int(len(user_ids) * AUTHORS_SHARE))]
+        return user_ids, shuffled(authors)
+
+    def _seed_recipes(self, options, authors):
+        tags = shuffled(Tag.objects.all())
+        tag_weights = zipf_cum_weights(len(tags))
+        ingredients = shuffled(Ingredient.objects.values_list('pk', 'name'))
+        ingredient_weights = zipf_cum_weights(len(ingredients))
+        author_weights = zipf_cum_weights(len(authors))
+        batch_size = options['batch_size']
+        recipe_ids = []
+        for start in range(0, options['recipes'], batch_size):
+            size = min(batch_size, options['recipes'] - start)
+            recipe_tags = [
+                pick(tags, tag_weights, random.randint(*TAGS_PER_RECIPE))
+                for _ in range(size)
+            ]
+            recipe_ingredients = [
+                pick(
+                    ingredients, ingredient_weights,
+                    random.randint(*INGREDIENTS_PER_RECIPE)
+                )
+                for _ in range(size)
+            ]
+            ids = self._bulk_create(
+                Recipe,
+                (
+                    Recipe(
+                        name=f'{chosen[0][1].capitalize()} '
+                             f'по-домашнему {start + number}',
+                        text='Смешать ' + ', '.join(
+                            name for _, name in chosen
+                        ) + '.',
+                        cooking_time=random.randint(5, 180),
+                        author_id=random.choices(
+                            authors, cum_weights=author_weights
+                        )[0],
+                        tags_mask=get_tags_mask(chosen_tags)
+                    )
+                    for number, (chosen, chosen_tags) in enumerate(
+                        zip(recipe_ingredients, recipe_tags)
+                    )
+                ),
+                batch_size
+            )
+            Recipe.tags.through.objects.bulk_create(
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=tag.pk)
+                for recipe_id, chosen in zip(ids, recipe_tags)
+                for tag in chosen
+            )
+            IngredientToRecipe.objects.bulk_create(
+                (
+                    IngredientToRecipe(
+                        recipe_id=recipe_id, ingredient_id=ingredient_id,
+                        amount=random.randint(1, 500)
+                    )
+                    for recipe_id, chosen in zip(ids, recipe_ingredients)
+                    for ingredient_id, _ in chosen
+                ),
+                batch_size=batch_size
+            )
+            recipe_ids.extend(ids)
+            self.stdout.write(
+                f'Рецептов: {len(recipe_ids)} из {options["recipes"]}'
+            )
+        return recipe_ids
+
+    def _seed_relations(self, options, user_ids, authors, recipe_ids):
+        """Подписки, избранное и корзины: число на пользователя
+        распределено экспоненциально, выбор - по популярности"""
+        recipes = shuffled(recipe_ids)
+        recipe_weights = zipf_cum_weights(len(recipes))
+        author_weights = zipf_cum_weights(len(authors))
+        relations = (
+            (Subscription, 'author_id', authors, author_weights,
+             options['subscriptions']),
+            (Favorite, 'recipe_id', recipes, recipe_weights,
+             options['favorites']),
+            (ShoppingCart, 'recipe_id', recipes, recipe_weights,
+             options['cart']),
+        )
+        for model, field, population, weights, mean in relations:
+            if not mean or not population:
+                continue
+            model.objects.bulk_create(
+                (
+                    model(user_id=user_id, **{field: member_id})
+                    for user_id in user_ids
+                    for member_id in pick(
+                        population, weights,
+                        min(len(population),
+                            round(random.expovariate(1 / mean)))
+                    )
+                    if member_id != user_id
+                ),
+                batch_size=options['batch_size']
+            )
+
+    def _seed(self, options):
+        started = time.perf_counter()
+        for model, command in ((Tag, 'load_tags'),
+                               (Ingredient, 'load_ingredients')):
+            if not model.objects.exists():
+                call_command(command, stdout=self.stdout)
+                self.loaded.append(model)
+        user_ids, authors = self._seed_users(options)
+        recipe_ids = self._seed_recipes(options, authors)
+        self._seed_relations(options, user_ids, authors, recipe_ids)
+        # Массовая вставка обходит сигналы: счетчики, итоги корзин,
+        # ленты и версии кэшей пересчитываются целиком
+        reconcile_counters()
+        rebuild_totals()
+        rebuild_feeds()
+        for model in SEEDED_MODELS:
+            bump_table_version(model)
+        bump_version('tags')
+        bump_version('ingredients')
+        return time.perf_counter() - started
+
+    def _describe_dataset(self):
+        return {
+            model._meta.db_table: model.objects.count()
+            for model in SEEDED_MODELS
+        }
+
+    def _prepare_clients(self, count):
+        """Клиенты с токенами и для каждого - рецепт и автор,
+        которых еще нет в его избранном, корзине и подписках"""
+        users = list(
+            User.objects.filter(is_active=True).exclude(
+                shopping_cart_u=None
+            ).order_by('?')[:count]
+        ) or list(User.objects.filter(is_active=True)[:count])
+        if not users:
+            raise CommandError('В БД нет пользователей для запросов')
+        clients = []
+        for user in users:
+            token, created = Token.objects.get_or_create(user=user)
+            if created:
+                self.token_keys.append(token.key)
+            clients.append({
+                'client': Client(HTTP_AUTHORIZATION=f'Token {token.key}'),
+                'user_id': user.pk,
+                'recipe_id': Recipe.objects.exclude(
+                    favorite_recipe__user=user
+                ).exclude(shopping_cart_r__user=user).values_list(
+                    'pk', flat=True
+                ).first(),
+                'author_id': User.objects.exclude(pk=user.pk).exclude(
+                    following__user=user
+                ).values_list('pk', flat=True).first(),
+            })
+        return clients
+
+    def _get_endpoints(self):
+        """(название, метод, путь(клиент), нужен ли токен).
+        Для POST/DELETE-пар четные запросы добавляют, нечетные удаляют"""
+        recipe_ids = list(
+            Recipe.objects.values_list('pk', flat=True).order_by('?')[:1000]
+        )
+        user_ids = list(
+            User.objects.values_list('pk', flat=True).order_by('?')[:1000]
+        )
+        author_ids = list(
+            Recipe.objects.values_list(
+                'author_id', flat=True
+            ).distinct().order_by()[:1000]
+        )
+        slugs = list(Tag.objects.values_list('slug', flat=True))
+        names = list(
+            Ingredient.objects.values_list('name', flat=True).order_by(
+                '?'
+            )[:100]
+        )
+        if not recipe_ids or not slugs or not names:
+            raise CommandError('Для замеров нужны рецепты, теги и ингредиенты')
+        pages = min(
+            100, Recipe.objects.count() // settings.REST_FRAMEWORK['PAGE_SIZE']
+        ) or 1
+        return (
+            ('tags', 'GET', lambda client: '/api/tags/', False),
+            ('ingredients?name=', 'GET', lambda client: (
+                f'/api/ingredients/?name={quote(random.choice(names)[:3])}'
+            ), False),
+            ('recipes (anonymous)', 'GET', lambda client: '/api/recipes/',
+             False),
+            ('recipes', 'GET', lambda client: '/api/recipes/', True),
+            ('recipes?page=', 'GET', lambda client: (
+                f'/api/recipes/?page={random.randint(1, pages)}'
+            ), True),
+            ('recipes?tags=', 'GET', lambda client: (
+                '/api/recipes/?' + '&'.join(
+                    f'tags={slug}'
+                    for slug in random.sample(slugs, min(2, len(slugs)))
+                )
+            ), True),
+            ('recipes?author=', 'GET', lambda client: (
+                f'/api/recipes/?author={random.choice(author_ids)}'
+            ), True),
+            ('recipes?search=', 'GET', lambda client: (
+                '/api/recipes/?search='
+                + quote(random.choice(names).split()[0])
+            ), True),
+            ('recipes?is_favorited=1', 'GET',
+             lambda client: '/api/recipes/?is_favorited=1', True),
+            ('recipes?is_in_shopping_cart=1', 'GET',
+             lambda client: '/api/recipes/?is_in_shopping_cart=1', True),
+            ('recipes/{id}/', 'GET', lambda client: (
+                f'/api/recipes/{random.choice(recipe_ids)}/'
+            ), True),
+            ('recipes/feed/', 'GET', lambda client: '/api/recipes/feed/',
+             True),
+            ('recipes/download_shopping_cart/', 'GET',
+             lambda client: '/api/recipes/download_shopping_cart/', True),
+            ('users', 'GET', lambda client: '/api/users/', True),
+            ('users/me/', 'GET', lambda client: '/api/users/me/', True),
+            ('users/{id}/', 'GET', lambda client: (
+                f'/api/users/{random.choice(user_ids)}/'
+            ), True),
+            ('users/subscriptions/', 'GET',
+             lambda client: '/api/users/subscriptions/?recipes_limit=3', True),
+            ('recipes/{id}/favorite/', 'POST/DELETE', lambda client: (
+                f'/api/recipes/{client["recipe_id"]}/favorite/'
+            ), True),
+            ('recipes/{id}/shopping_cart/', 'POST/DELETE', lambda client: (
+                f'/api/recipes/{client["recipe_id"]}/shopping_cart/'
+            ), True),
+            ('users/{id}/subscribe/', 'POST/DELETE', lambda client: (
+                f'/api/users/{client["author_id"]}/subscribe/'
+            ), True),
+        )
+
+    def _request(self, anonymous, clients, method, path, number):
+        """Один запрос; пары POST/DELETE идут от одного клиента"""
+        if method == 'POST/DELETE':
+            client = clients[number // 2 % len(clients)]
+            method = 'POST' if number % 2 == 0 else 'DELETE'
+        else:
+            client = clients[number % len(clients)]
+        http = anonymous if client is None else client['client']
+        response = getattr(http, method.lower())(path(client))
+        read_response(response)
+        return response.status_code
+
+    def _measure(self, endpoint, options, anonymous, clients):
+        name, method, path, authenticated = endpoint
+        if not authenticated:
+            clients = [None]
+        for number in range(even(options['warmup'])):
+            self._request(anonymous, clients, method, path, number)
+        timings = []
+        queries = []
+        errors = 0
+        started = time.perf_counter()
+        for number in range(even(options['requests'])):
+            with CaptureQueriesContext(connection) as context:
+                request_started = time.perf_counter()
+                status = self._request(
+                    anonymous, clients, method, path, number
+                )
+                timings.append(time.perf_counter() - request_started)
+            queries.append(len(context.captured_queries))
+            errors += status >= 400
+        elapsed = time.perf_counter() - started
+        tracemalloc.start()
+        for number in range(even(options['memory_requests'])):
+            self._request(anonymous, clients, method, path, number)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        timings.sort()
+        return {
+            'name': name,
+            'method': method,
+            'requests': len(timings),
+            'errors': errors,
+            'p50_ms': round(percentile(timings, 0.5) * 1e3, 3),
+            'p95_ms': round(percentile(timings, 0.95) * 1e3, 3),
+            'p99_ms': round(percentile(timings, 0.99) * 1e3, 3),
+            'mean_ms': round(sum(timings) / len(timings) * 1e3, 3),
+            'throughput_rps': round(len(timings) / elapsed, 1),
+            'queries_mean': round(sum(queries) / len(queries), 2),
+            'queries_max': max(queries),
+            'peak_memory_kb': round(peak_memory / 1024, 1),
+        }
+
+    def _run(self, options):
+        anonymous = Client()
+        clients = self._prepare_clients(options['clients'])
+        results = []
+        self.stdout.write(
+            f'{"Эндпоинт":<34}{"p50":>9}{"p95":>9}{"p99":>9}'
+            f'{"rps":>8}{"SQL":>7}{"КБ":>9}{"ошибок":>8}'
+        )
+        for endpoint in self._get_endpoints():
+            result = self._measure(endpoint, options, anonymous, clients)
+            results.append(result)
+            self.stdout.write(
+                f'{result["name"]:<34}{result["p50_ms"]:>9.2f}'
+                f'{result["p95_ms"]:>9.2f}{result["p99_ms"]:>9.2f}'
+                f'{result["throughput_rps"]:>8.0f}'
+                f'{result["queries_mean"]:>7.1f}'
+                f'{result["peak_memory_kb"]:>9.0f}{result["errors"]:>8}'
+            )
+        return results
+
+    def _delete_in_batches(self, queryset):
+        ids = list(queryset.values_list('pk', flat=True))
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            queryset.model.objects.filter(
+                pk__in=ids[start:start + DELETE_BATCH_SIZE]
+            ).delete()
+
+    def _cleanup(self):
+        """Удаляет сгенерированные данные и выданные токены. Обычное
+        удаление, а не откат: счетчики, итоги корзин, ленты и кэши
+        обновляются сигналами и их on_commit-обработчиками"""
+        Token.objects.filter(key__in=self.token_keys).delete()
+        if self.prefix is not None:
+            self._delete_in_batches(
+                Recipe.objects.filter(author__username__startswith=self.prefix)
+            )
+            self._delete_in_batches(
+                User.objects.filter(username__startswith=self.prefix)
+            )
+        for model in self.loaded:
+            model.objects.all().delete()
+        self.stdout.write('Сгенерированные данные удалены')
+
+    def _compare(self, path, results):
+        """Изменение p95 относительно прошлого отчета"""
+        with open(path, encoding='utf-8') as file:
+            previous = {
+                result['name']: result
+                for result in json.load(file)['endpoints']
+            }
+        self.stdout.write(f'\nСравнение p95 с {path}:')
+        for result in results:
+            before = previous.get(result['name'])
+            if before is None or not before['p95_ms']:
+                continue
+            change = result['p95_ms'] / before['p95_ms'] - 1
+            self.stdout.write(
+                f'{result["name"]:<34}{before["p95_ms"]:>9.2f} -> '
+                f'{result["p95_ms"]:>9.2f} мс ({change:+.0%})'
+            )
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--requests и --batch-size должны быть > 0')
+        random.seed(options['seed'])
+        seed_seconds = None
+        self.prefix = None
+        self.loaded = []
+        self.token_keys = []
+        started = datetime.now()
+        # Данные фиксируются, а замеры идут вне транзакции:
+        # иначе не срабатывают on_commit-обработчики запросов
+        if not options['no_seed']:
+            with transaction.atomic():
+                seed_seconds = self._seed(options)
+        try:
+            dataset = self._describe_dataset()
+            self.stdout.write(
+                'Данные: ' + ', '.join(
+                    f'{table} {count}' for table, count in dataset.items()
+                )
+            )
+            results = self._run(options)
+        finally:
+            if not options['keep']:
+                self._cleanup()
+        report = {
+            'started': started.isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'options': {
+                name: options[name] for name in (
+                    'users', 'recipes', 'subscriptions', 'favorites', 'cart',
+                    'requests', 'warmup', 'clients', 'seed', 'no_seed', 'keep'
+                )
+            },
+            'seed_seconds': seed_seconds,
+            'dataset': dataset,
+            'endpoints': results,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        if options['compare']:
+            self._compare(options['compare'], results)
+        self.stdout.write(self.style.SUCCESS(
+            f'==>>> Замеры завершены, отчет сохранен в {options["output"]} '
+            f'<<<=='
+        ))
@@ -0,0 +1,58 @@
+import time
+
+from django.core.management import BaseCommand
+from recipes.ingredient_search import ingredient_index
+from recipes.models import Ingredient
+
+DEFAULT_QUERIES = (
+    'а', 'абр', 'абрикосс', 'сахр', 'сахар', 'мука пш', 'молоко',
+    'яйцо', 'ёрш', 'картофль', 'помидор', 'сыр', 'xyz',
+)
+
+
+class Command(BaseCommand):
+    help = ('Compare ingredient search: istartswith filter '
+            'against the in-memory prefix and trigram index')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=200,
+            help='How many times to run every query'
+        )
+        parser.add_argument(
+            'queries', nargs='*',
+            help='Queries to run instead of the default set'
+        )
+
+    def _measure(self, search, queries, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for query in queries:
+                search(query)
+        return (time.perf_counter() - start) / (repeat * len(queries))
+
+    def handle(self, *args, **options):
+        queries = options['queries'] or DEFAULT_QUERIES
+        repeat = options['repeat']
+        ingredient_index.build()
+        engines = (
+            ('istartswith (БД)', lambda query: list(
+                Ingredient.objects.filter(name__istartswith=query)
+            )),
+            ('префиксный индекс', ingredient_index.search),
+            ('триграммный индекс', ingredient_index.fuzzy_search),
+        )
+        self.stdout.write(
+            f'Ингредиентов: {Ingredient.objects.count()}, '
+            f'запросов: {len(queries)} x {repeat}'
+        )
+        for title, search in engines:
+            seconds = self._measure(search, queries, repeat)
+            self.stdout.write(f'{title:<20} {seconds * 1e6:>10.1f} мкс/запрос')
+        self.stdout.write('')
+        for query in queries:
+            found = [
+                ingredient.name
+                for ingredient in ingredient_index.fuzzy_search(query, 3)
+            ]
+            self.stdout.write(f'{query!r:<12} -> {", ".join(found)}')
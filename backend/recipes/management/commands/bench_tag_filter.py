@@ -0,0 +1,131 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand
+from django.db import transaction
+from recipes.models import Recipe, Tag
+from recipes.tag_masks import filter_by_tags, get_tags_mask
+
+User = get_user_model()
+
+BENCH_TAGS = 5
+PAGE_SIZE = 6
+
+
+class Rollback(Exception):
+    """Откатывает тестовые данные после замеров"""
+
+
+class Command(BaseCommand):
+    help = ('Compare multi-tag recipe filtering: JOIN on tags__slug '
+            'against the tags_mask bitwise predicate')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes', type=int, default=100000,
+            help='How many synthetic recipes to generate'
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='How many times to run every query'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Rows per INSERT statement'
+        )
+
+    def _seed(self, total, batch_size):
+        author = User.objects.create(
+            username='bench_tag_filter', email='bench_tag_filter@example.com'
+        )
+        tags = [
+            Tag.objects.create(
+                name=f'bench{number}', color=f'#bench{number}',
+                slug=f'bench-{number}'
+            )
+            for number in range(BENCH_TAGS)
+        ]
+        through = Recipe.tags.through
+        for start in range(0, total, batch_size):
+            chosen = [
+                random.sample(tags, random.randint(1, 3))
+                for _ in range(start, min(start + batch_size, total))
+            ]
+            recipes = Recipe.objects.bulk_create(
+                Recipe(
+                    name=f'bench-{start + number}', text='bench',
+                    cooking_time=1, author=author,
+                    tags_mask=get_tags_mask(recipe_tags)
+                )
+                for number, recipe_tags in enumerate(chosen)
+            )
+            if recipes[0].pk is None:
+                recipes = Recipe.objects.filter(
+                    author=author
+                ).order_by('pk')[start:start + len(chosen)]
+            through.objects.bulk_create(
+                through(recipe_id=recipe.pk, tag_id=tag.pk)
+                for recipe, recipe_tags in zip(recipes, chosen)
+                for tag in recipe_tags
+            )
+        return tags
+
+    def _measure(self, run, repeat):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            result = run()
+        return (time.perf_counter() - start) / repeat, result
+
+    def _join_queryset(self, tags, match_all):
+        queryset = Recipe.objects.all()
+        if match_all:
+            for tag in tags:
+                queryset = queryset.filter(tags__slug=tag.slug)
+            return queryset
+        return queryset.filter(
+            tags__slug__in=[tag.slug for tag in tags]
+        ).distinct()
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        try:
+            with transaction.atomic():
+                started = time.perf_counter()
+                tags = self._seed(options['recipes'], options['batch_size'])
+                self.stdout.write(
+                    f'Рецептов: {Recipe.objects.count()}, тестовые данные '
+                    f'созданы за {time.perf_counter() - started:.1f} с, '
+                    f'запросов: {repeat}'
+                )
+                for title, match_all in (('any', False), ('all', True)):
+                    for size in (1, 2, 3):
+                        chosen = tags[:size]
+                        querysets = (
+                            ('JOIN', self._join_queryset(chosen, match_all)),
+                            ('маска', filter_by_tags(
+                                Recipe.objects.all(), chosen, match_all
+                            )),
+                        )
+                        for engine, queryset in querysets:
+                            count_time, count = self._measure(
+                                queryset.count, repeat
+                            )
+                            page_time, _ = self._measure(
+                                lambda: list(queryset.values_list(
+                                    'pk', flat=True
+                                )[:PAGE_SIZE]),
+                                repeat
+                            )
+                            self.stdout.write(
+                                f'{title} из {size} тегов, {engine:<6} '
+                                f'найдено {count:>7}  '
+                                f'count {count_time * 1e3:>8.2f} мс  '
+                                f'страница {page_time * 1e3:>8.2f} мс'
+                            )
+                raise Rollback
+        except Rollback:
+            pass
+        self.stdout.write(self.style.SUCCESS(
+            '==>>> Замеры завершены, тестовые данные удалены <<<=='
+        ))
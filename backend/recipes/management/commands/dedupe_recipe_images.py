@@ -0,0 +1,62 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+from recipes.images import image_storage, release_image
+from recipes.models import Recipe
+from recipes.storage import is_content_addressed
+
+IMAGES_DIR = 'recipes/images'
+
+
+class Command(BaseCommand):
+    help = ('Move recipe images to content-addressed names '
+            'and delete image files no recipe refers to')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only show what would be changed'
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        moved = 0
+        recipes = Recipe.objects.exclude(image='').exclude(image=None)
+        for recipe in recipes.iterator():
+            name = recipe.image.name
+            if is_content_addressed(name):
+                continue
+            if not image_storage.exists(name):
+                self.stderr.write(f'{recipe}: файл {name} не найден')
+                continue
+            moved += 1
+            if dry_run:
+                self.stdout.write(f'~ {name}')
+                continue
+            # Блокировка имени из save держится до записи ссылки
+            with transaction.atomic(), image_storage.open(name) as file:
+                recipe.image.name = image_storage.save(name, file)
+                recipe.save(update_fields=['image'])
+            self.stdout.write(f'~ {name} -> {recipe.image.name}')
+
+        used = set(recipes.values_list('image', flat=True))
+        orphans = [
+            f'{IMAGES_DIR}/{filename}'
+            for filename in image_storage.listdir(IMAGES_DIR)[1]
+            if f'{IMAGES_DIR}/{filename}' not in used
+        ] if image_storage.exists(IMAGES_DIR) else []
+        for name in orphans:
+            self.stdout.write(f'- {name}')
+            if not dry_run:
+                release_image(name)
+
+        self.stdout.write(
+            f'Перенесено: {moved}, удалено лишних: {len(orphans)}'
+        )
+        if dry_run:
+            self.stdout.write(self.style.WARNING(
+                '==>>> Пробный запуск: файлы не изменены <<<=='
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                '==>>> Изображения рецептов упорядочены <<<=='
+            ))
@@ -1,25 +1,150 @@
 import csv
+import json
+import os
+import time
 
 from foodgram.settings import DIR_DATA_CSV
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+from recipes.cache import bump_version
 from recipes.models import Ingredient
 
+FIELDS = ('name', 'measurement_unit')
+READ_SIZE = 64 * 1024
+
+
+def iter_csv(file):
+    """Построчно читает csv без заголовка: name,measurement_unit"""
+    for row in csv.DictReader(file, fieldnames=FIELDS):
+        yield row
+
+
+def iter_json(file):
+    """Потоково читает json-массив объектов, не загружая файл целиком"""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    while True:
+        chunk = file.read(READ_SIZE)
+        buffer += chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started and position < len(buffer):
+                if buffer[position] != '[':
+                    raise CommandError('Ожидается json-массив ингредиентов')
+                started = True
+                position += 1
+                continue
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                row, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            yield row
+        buffer = buffer[position:]
+        if not chunk:
+            if buffer.strip():
+                raise CommandError('Файл ингредиентов обрывается')
+            return
+
+
+READERS = {
+    'csv': iter_csv,
+    'json': iter_json,
+}
+
 
 class Command(BaseCommand):
-    help = 'Load data from csv file by the directory /data/'
-
-    def handle(self, *args, **kwargs):
-        with open(
-            f'{DIR_DATA_CSV}/ingredients.csv',
-            newline="",
-            encoding='utf-8'
-        ) as file:
-            reader = csv.DictReader(file, fieldnames=[
-                'name', 'measurement_unit'
-            ])
-            for row in reader:
-                Ingredient.objects.update_or_create(**row)
-
-        self.stdout.write(self.style.SUCCESS(
-            '==>>> Ингредиенты успешно загружены в БД <<<=='
-        ))
+    help = 'Load ingredients from a csv or json file (default /data/)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            default=os.path.join(DIR_DATA_CSV, 'ingredients.csv'),
+            help='Path to the csv or json file with ingredients'
+        )
+        parser.add_argument(
+            '--format', choices=READERS,
+            help='File format, by default taken from the file extension'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Rows per INSERT statement and progress step'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Show what would be added without writing to the DB'
+        )
+
+    def read_rows(self, path, file_format):
+        """Уникальные пары (name, measurement_unit) из файла
+        и число отброшенных повторов и пустых строк"""
+        rows = {}
+        total = 0
+        with open(path, newline='', encoding='utf-8') as file:
+            for row in READERS[file_format](file):
+                total += 1
+                key = tuple(
+                    str(row.get(field) or '').strip() for field in FIELDS
+                )
+                if all(key):
+                    rows.setdefault(key, None)
+        return list(rows), total - len(rows)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        path = options['file']
+        file_format = (
+            options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        )
+        if file_format not in READERS:
+            raise CommandError(f'Неизвестный формат файла: {path}')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше нуля')
+        rows, skipped = self.read_rows(path, file_format)
+        existing = set(Ingredient.objects.values_list(*FIELDS))
+        new_rows = [row for row in rows if row not in existing]
+        parsed = time.perf_counter()
+
+        if options['dry_run']:
+            for name, measurement_unit in new_rows:
+                self.stdout.write(f'+ {name} ({measurement_unit})')
+        else:
+            batch_size = options['batch_size']
+            with transaction.atomic():
+                for start in range(0, len(new_rows), batch_size):
+                    batch = new_rows[start:start + batch_size]
+                    Ingredient.objects.bulk_create(
+                        [
+                            Ingredient(name=name, measurement_unit=unit)
+                            for name, unit in batch
+                        ],
+                        ignore_conflicts=True
+                    )
+                    self.stdout.write(
+                        f'Записано {start + len(batch)} из {len(new_rows)}'
+                    )
+            if new_rows:
+                bump_version('ingredients')
+        finished = time.perf_counter()
+
+        self.stdout.write(
+            f'Прочитано: {len(rows) + skipped}, повторов и пустых: {skipped}, '
+            f'уже в БД: {len(rows) - len(new_rows)}, '
+            f'новых: {len(new_rows)}'
+        )
+        self.stdout.write(
+            f'Разбор: {parsed - started:.3f} с, '
+            f'запись: {finished - parsed:.3f} с'
+        )
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(
+                '==>>> Пробный запуск: БД не изменена <<<=='
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                '==>>> Ингредиенты успешно загружены в БД <<<=='
+            ))
@@ -14,7 +14,9 @@ class Command(BaseCommand):
             {'name': 'Сладенькое', 'color': '#c9a2bf', 'slug': 'sweet'},
             {'name': 'Острое', 'color': '#cc0000', 'slug': 'sharp'},
         ]
-        Tag.objects.bulk_create(Tag(**tag) for tag in data)
+        # По одному: сигналы выдают биты и сбрасывают кэши тегов
+        for tag in data:
+            Tag.objects.create(**tag)
 
         self.stdout.write(self.style.SUCCESS(
             '==>> Стандартные теги успешно загружены в БД <<=='
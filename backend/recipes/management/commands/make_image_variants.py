@@ -0,0 +1,31 @@
+from django.core.management import BaseCommand
+from recipes.images import has_current_variants, make_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Create missing thumbnail and WebP variants of recipe images'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Recreate variants that already exist'
+        )
+
+    def handle(self, *args, **options):
+        created = 0
+        recipes = Recipe.objects.exclude(image='').exclude(image=None).only(
+            'id', 'image', 'image_variants'
+        )
+        for recipe in recipes.iterator():
+            if has_current_variants(recipe) and not options['force']:
+                continue
+            try:
+                make_variants(recipe.id, recipe.image.name)
+            except (OSError, ValueError) as error:
+                self.stderr.write(f'{recipe.image.name}: {error}')
+                continue
+            created += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'==>>> Варианты изображений созданы для {created} рецептов <<<=='
+        ))
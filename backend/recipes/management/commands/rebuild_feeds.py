@@ -0,0 +1,14 @@
+from django.core.management import BaseCommand
+from recipes.feed import rebuild_feeds
+from recipes.models import FeedItem
+
+
+class Command(BaseCommand):
+    help = 'Rebuild subscription feeds from current subscriptions'
+
+    def handle(self, *args, **kwargs):
+        rebuild_feeds()
+        self.stdout.write(self.style.SUCCESS(
+            f'==>>> Ленты подписок пересобраны: '
+            f'{FeedItem.objects.count()} записей <<<=='
+        ))
@@ -0,0 +1,32 @@
+from django.core.management import BaseCommand, CommandError
+from recipes.cart_totals import rebuild_totals
+
+
+class Command(BaseCommand):
+    help = 'Rebuild and verify shopping list totals from shopping carts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only report drift, do not fix it'
+        )
+
+    def handle(self, *args, **options):
+        created, updated, deleted = rebuild_totals(dry_run=options['check'])
+        drift = created + updated + deleted
+        self.stdout.write(
+            f'Отсутствует: {created}, расходится: {updated}, '
+            f'лишних: {deleted}'
+        )
+        if not drift:
+            self.stdout.write(self.style.SUCCESS(
+                '==>>> Списки покупок совпадают с корзинами <<<=='
+            ))
+        elif options['check']:
+            raise CommandError(
+                '==>>> Списки покупок расходятся с корзинами <<<=='
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                '==>>> Списки покупок пересобраны <<<=='
+            ))
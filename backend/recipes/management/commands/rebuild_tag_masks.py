@@ -0,0 +1,26 @@
+from django.core.management import BaseCommand, CommandError
+from recipes.tag_masks import rebuild_tag_masks
+
+
+class Command(BaseCommand):
+    help = 'Assign tag bits and rebuild recipe tag masks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only report drift, do not fix it'
+        )
+
+    def handle(self, *args, **options):
+        drifted = rebuild_tag_masks(dry_run=options['check'])
+        self.stdout.write(f'Рецептов с неверной маской тегов: {drifted}')
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS(
+                '==>>> Маски тегов совпадают с данными <<<=='
+            ))
+        elif options['check']:
+            raise CommandError('==>>> Маски тегов расходятся с данными <<<==')
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                '==>>> Маски тегов пересобраны <<<=='
+            ))
@@ -0,0 +1,27 @@
+from django.core.management import BaseCommand, CommandError
+from recipes.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = 'Reconcile denormalized recipe and user counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only report drift, do not fix it'
+        )
+
+    def handle(self, *args, **options):
+        drift = reconcile_counters(dry_run=options['check'])
+        for counter, drifted in drift.items():
+            self.stdout.write(f'{counter}: расхождений {drifted}')
+        if not any(drift.values()):
+            self.stdout.write(self.style.SUCCESS(
+                '==>>> Счетчики совпадают с данными <<<=='
+            ))
+        elif options['check']:
+            raise CommandError('==>>> Счетчики расходятся с данными <<<==')
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                '==>>> Счетчики исправлены <<<=='
+            ))
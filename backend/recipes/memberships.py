@@ -0,0 +1,40 @@
+"""Множества id рецептов в избранном и в корзине пользователя и id авторов
+в его подписках. Загружаются одним запросом и хранятся в кэше
+под версией множества; сигналы добавления и удаления меняют версию,
+а не само множество, поэтому параллельные изменения не теряются"""
+from django.conf import settings
+from django.core.cache import cache
+from users.models import Subscription
+
+from .cache import get_version
+from .models import Favorite, ShoppingCart
+
+MEMBERSHIP_KEY = 'memberships:{}:{}:{}'
+MEMBERSHIP_VERSION = 'memberships:{}:{}'
+# вид множества: (модель связи, поле с id элемента)
+MEMBERSHIPS = {
+    'favorites': (Favorite, 'recipe_id'),
+    'cart': (ShoppingCart, 'recipe_id'),
+    'subscriptions': (Subscription, 'author_id'),
+}
+
+
+def load_members(user_id, kind):
+    """Множество id элементов вида kind у пользователя из БД"""
+    model, field = MEMBERSHIPS[kind]
+    return set(
+        model.objects.filter(user_id=user_id).values_list(field, flat=True)
+    )
+
+
+def get_members(user_id, kind):
+    """Множество id элементов вида kind у пользователя.
+    Версия читается до запроса к БД: если изменение зафиксируют после
+    него, устаревшее множество останется под прежней версией"""
+    version = get_version(MEMBERSHIP_VERSION.format(user_id, kind))
+    key = MEMBERSHIP_KEY.format(user_id, kind, version)
+    members = cache.get(key)
+    if members is None:
+        members = load_members(user_id, kind)
+        cache.set(key, members, settings.MEMBERSHIP_TTL)
+    return members
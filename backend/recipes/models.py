@@ -1,8 +1,11 @@
 from django.db import models
 from django.contrib.auth import get_user_model
+from foodgram.models import UpdateOnlyFieldsMixin
 from foodgram.settings import TEXT_SL
 from django.core.validators import MinValueValidator, RegexValidator
 
+from .storage import recipe_image_storage
+
 User = get_user_model()
 
 
@@ -38,6 +41,12 @@ class Tag(models.Model):
         verbose_name='slug тега',
         help_text='Введите сокращенние для тега',
     )
+    bit = models.PositiveSmallIntegerField(
+        unique=True,
+        null=True,
+        editable=False,
+        verbose_name='Бит в маске тегов рецепта',
+    )
 
     class Meta:
         verbose_name = 'Тег',
@@ -47,6 +56,10 @@ class Tag(models.Model):
     def __str__(self):
         return f'{self.name}, ({self.slug[:TEXT_SL]})'
 
+    @property
+    def mask(self):
+        return 0 if self.bit is None else 1 << self.bit
+
 
 class Ingredient(models.Model):
     """Класс модели Ингредиентов"""
@@ -76,7 +89,7 @@ class Ingredient(models.Model):
         return f'{self.name[:TEXT_SL]} ({self.measurement_unit})'
 
 
-class Recipe(models.Model):
+class Recipe(UpdateOnlyFieldsMixin, models.Model):
     """Класс модели Рецептов"""
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -93,11 +106,18 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         upload_to='recipes/images/',
+        storage=recipe_image_storage,
         verbose_name='Изображение',
         blank=True,
         null=True,
         help_text='Добавьте фото к Вашему рецепту',
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Уменьшенные копии изображения',
+    )
     name = models.CharField(
         max_length=200,
         unique=True,
@@ -128,6 +148,27 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name='Дата публикации',
     )
+    favorite_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном',
+    )
+    cart_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В корзинах',
+    )
+    tags_mask = models.BigIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Маска тегов',
+    )
+
+    # Маску тоже меняют UPDATE (release_bit и update_tags_mask),
+    # варианты изображения - фоновая задача make_variants
+    update_only_fields = (
+        'favorite_count', 'cart_count', 'tags_mask', 'image_variants'
+    )
 
     class Meta:
         verbose_name = 'Рецепт'
@@ -214,6 +255,90 @@ class ShoppingCart(models.Model):
                 f'добавлены в список покупок пользователя {self.user}')
 
 
+class ShoppingListItem(models.Model):
+    """Класс модели итогового количества ингредиента в корзине.
+    Поддерживается при изменении корзины и рецептов в ней"""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Ингредиент',
+    )
+    total_amount = models.PositiveIntegerField(
+        verbose_name='Общее количество',
+    )
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Списки покупок (итоги)'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            ),
+        ]
+
+    def __str__(self):
+        return (f'{self.ingredient.name} ({self.total_amount}) '
+                f'в списке покупок пользователя {self.user}')
+
+
+class FeedItem(models.Model):
+    """Класс модели ленты подписок: рецепт автора, на которого
+    подписан пользователь. Заполняется при публикации рецепта"""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='Подписчик',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='Рецепт',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор рецепта',
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    class Meta:
+        verbose_name = 'Рецепт в ленте'
+        verbose_name_plural = 'Ленты подписок'
+        ordering = ('-pub_date', '-recipe')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_feed_item'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='feed_item_user_date_idx'
+            ),
+            models.Index(
+                fields=['user', 'author'],
+                name='feed_item_user_author_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'Рецепт <<{self.recipe}>> в ленте пользователя {self.user}'
+
+
 class Favorite(models.Model):
     """Класс модели Избранных"""
     recipe = models.ForeignKey(
@@ -0,0 +1,89 @@
+"""Добавление и удаление рецептов в избранное и корзину одним запросом,
+без ошибок на повторах. Для изменившихся строк отправляются сигналы
+post_save и pre_delete/post_delete, поэтому счетчики, итоги корзины
+и множества пользователя обновляются так же, как при save() и delete()"""
+from django.db import connections, router, transaction
+from django.db.models.signals import post_delete, post_save, pre_delete
+
+from .models import Recipe
+
+
+def execute_returning(model, sql, params):
+    """Выполняет запрос с RETURNING id, recipe_id и возвращает
+    несохраняемые объекты model для изменившихся строк"""
+    using = router.db_for_write(model)
+    with connections[using].cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    return using, [
+        model(pk=pk, user_id=params[0], recipe_id=recipe_id)
+        for pk, recipe_id in rows
+    ]
+
+
+def get_sql_names(model):
+    quote_name = connections[router.db_for_write(model)].ops.quote_name
+    return (
+        quote_name(model._meta.db_table),
+        quote_name(Recipe._meta.db_table),
+        quote_name(model._meta.pk.column),
+    )
+
+
+@transaction.atomic
+def add_recipes(model, user, recipe_ids):
+    """INSERT ... ON CONFLICT DO NOTHING для существующих рецептов
+    из recipe_ids. Возвращает id действительно добавленных"""
+    recipe_ids = sorted(set(recipe_ids))
+    if not recipe_ids:
+        return []
+    table, recipes, pk = get_sql_names(model)
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    using, added = execute_returning(
+        model,
+        f'INSERT INTO {table} (user_id, recipe_id) '
+        f'SELECT %s, id FROM {recipes} WHERE id IN ({placeholders}) '
+        f'ON CONFLICT DO NOTHING RETURNING {pk}, recipe_id',
+        [user.pk, *recipe_ids]
+    )
+    for instance in added:
+        post_save.send(
+            sender=model, instance=instance, created=True,
+            update_fields=None, raw=False, using=using
+        )
+    return [instance.recipe_id for instance in added]
+
+
+@transaction.atomic
+def remove_recipes(model, user, recipe_ids):
+    """Блокирует строки по recipe_ids, отправляет для них pre_delete
+    и удаляет их. Параллельный повтор ждет блокировки и уже не находит
+    удаленных строк. Возвращает id действительно удаленных.
+    Блокировка - пустой UPDATE, а не SELECT ... FOR UPDATE: в SQLite
+    транзакция, начатая чтением, не дожидается записи параллельной"""
+    recipe_ids = sorted(set(recipe_ids))
+    if not recipe_ids:
+        return []
+    table, _, pk = get_sql_names(model)
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    using, locked = execute_returning(
+        model,
+        f'UPDATE {table} SET user_id = user_id '
+        f'WHERE user_id = %s AND recipe_id IN ({placeholders}) '
+        f'RETURNING {pk}, recipe_id',
+        [user.pk, *recipe_ids]
+    )
+    if not locked:
+        return []
+    for instance in locked:
+        pre_delete.send(sender=model, instance=instance, using=using)
+    placeholders = ', '.join(['%s'] * len(locked))
+    using, removed = execute_returning(
+        model,
+        f'DELETE FROM {table} WHERE user_id = %s AND {pk} IN ({placeholders}) '
+        f'RETURNING {pk}, recipe_id',
+        [user.pk, *(instance.pk for instance in locked)]
+    )
+    for instance in removed:
+        post_delete.send(sender=model, instance=instance, using=using)
+    return [instance.recipe_id for instance in removed]
@@ -0,0 +1,122 @@
+"""Полнотекстовый поиск рецептов по названию и описанию.
+PostgreSQL - GIN-индекс по to_tsvector со стеммингом
+RECIPE_SEARCH_CONFIG, SQLite - таблица FTS5, которую поддерживают
+триггеры. Индексы создаются после migrate"""
+import re
+
+from django.conf import settings
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVectorField)
+from django.db import connections
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+from .models import Recipe
+
+RECIPE_TABLE = Recipe._meta.db_table
+FTS_TABLE = f'{RECIPE_TABLE}_fts'
+# Название важнее описания: веса A/B в PostgreSQL и bm25 в SQLite
+POSTGRES_DOCUMENT = (
+    "setweight(to_tsvector('{config}', coalesce({name}, '')), 'A') || "
+    "setweight(to_tsvector('{config}', coalesce({text}, '')), 'B')"
+)
+SQLITE_WEIGHTS = (10.0, 1.0)
+
+
+def get_postgres_document(quote_name, table=None):
+    """Выражение tsvector рецепта, одинаковое в индексе и в запросе,
+    иначе планировщик не сможет использовать индекс"""
+    prefix = f'{quote_name(table)}.' if table else ''
+    return POSTGRES_DOCUMENT.format(
+        config=settings.RECIPE_SEARCH_CONFIG,
+        name=prefix + quote_name('name'),
+        text=prefix + quote_name('text'),
+    )
+
+
+def install_search_index(using='default', **kwargs):
+    """Создает поисковый индекс (обработчик post_migrate)"""
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            index = f'recipe_search_{settings.RECIPE_SEARCH_CONFIG}_idx'
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS {quote_name(index)} '
+                f'ON {quote_name(RECIPE_TABLE)} '
+                f'USING gin (({get_postgres_document(quote_name)}))'
+            )
+        elif connection.vendor == 'sqlite':
+            fts, recipes = quote_name(FTS_TABLE), quote_name(RECIPE_TABLE)
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5('
+                f"name, text, content={recipes}, content_rowid='id', "
+                f"tokenize='unicode61 remove_diacritics 2')"
+            )
+            old_row = (
+                f'INSERT INTO {fts}({fts}, rowid, name, text) '
+                f"VALUES('delete', old.id, old.name, old.text);"
+            )
+            new_row = (
+                f'INSERT INTO {fts}(rowid, name, text) '
+                f'VALUES(new.id, new.name, new.text);'
+            )
+            for suffix, event, body in (
+                ('ai', 'AFTER INSERT', new_row),
+                ('ad', 'AFTER DELETE', old_row),
+                ('au', 'AFTER UPDATE OF name, text', old_row + new_row),
+            ):
+                trigger = quote_name(f'{FTS_TABLE}_{suffix}')
+                cursor.execute(
+                    f'CREATE TRIGGER IF NOT EXISTS {trigger} {event} '
+                    f'ON {recipes} BEGIN {body} END'
+                )
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES('rebuild')")
+
+
+def get_sqlite_query(query):
+    """Запрос FTS5: все слова по префиксу - грубая замена стемминга"""
+    return ' '.join(
+        '"{}"*'.format(word) for word in re.findall(r'\w+', query.lower())
+    )
+
+
+def search_recipes(queryset, query):
+    """Рецепты, подходящие под query, с релевантностью в search_rank;
+    самые релевантные первыми"""
+    connection = connections[queryset.db]
+    quote_name = connection.ops.quote_name
+    ordering = queryset.query.order_by
+    if connection.vendor == 'postgresql':
+        document = RawSQL(
+            get_postgres_document(quote_name, RECIPE_TABLE), [],
+            output_field=SearchVectorField()
+        )
+        search_query = SearchQuery(
+            query,
+            config=settings.RECIPE_SEARCH_CONFIG,
+            search_type='websearch'
+        )
+        queryset = queryset.alias(search_document=document).filter(
+            search_document=search_query
+        ).annotate(search_rank=SearchRank(document, search_query))
+    elif connection.vendor == 'sqlite':
+        match = get_sqlite_query(query)
+        if not match:
+            return queryset.none()
+        fts = quote_name(FTS_TABLE)
+        pk = f'{quote_name(RECIPE_TABLE)}.{quote_name("id")}'
+        weights = ', '.join(str(weight) for weight in SQLITE_WEIGHTS)
+        queryset = queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {fts} WHERE {fts} MATCH %s', (match,)
+        )).annotate(search_rank=RawSQL(
+            f'SELECT -bm25({fts}, {weights}) FROM {fts} '
+            f'WHERE {fts} MATCH %s AND rowid = {pk}',
+            (match,),
+            output_field=FloatField()
+        ))
+    else:
+        return queryset.filter(
+            Q(name__icontains=query) | Q(text__icontains=query)
+        )
+    return queryset.order_by('-search_rank', *ordering)
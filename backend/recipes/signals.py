@@ -0,0 +1,178 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from users.models import Subscription
+
+from .cache import (RECIPE_VERSION, USER_VERSION, bump_table_version,
+                    bump_version, bump_version_on_commit)
+from .cart_totals import apply_recipe
+from .counters import change_counter
+from .feed import backfill, publish, trim
+from .images import schedule_release, schedule_variants
+from .memberships import MEMBERSHIP_VERSION, MEMBERSHIPS
+from .models import (Favorite, Ingredient, IngredientToRecipe, Recipe,
+                     ShoppingCart, Tag)
+from .tag_masks import assign_bit, release_bit
+
+User = get_user_model()
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def ingredients_changed(**kwargs):
+    """Сбрасывает индекс и снимок ингредиентов при изменении справочника"""
+    bump_version('ingredients')
+
+
+@receiver(post_save, sender=Tag)
+def tag_created(instance, created, **kwargs):
+    """Выдает бит новому тегу, в том числе при loaddata.
+    У нового тега еще нет рецептов, поэтому маски пересчитывать не нужно;
+    существующим тегам биты выдает rebuild_tag_masks"""
+    if created and instance.bit is None:
+        assign_bit(instance)
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def tags_changed(**kwargs):
+    """Сбрасывает снимок тегов при изменении справочника"""
+    bump_version('tags')
+
+
+@receiver(post_delete, sender=Tag)
+def tag_deleted(instance, **kwargs):
+    """Освобождает бит удаленного тега в масках рецептов"""
+    release_bit(instance)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def recipe_added_to_cart(instance, created, **kwargs):
+    """Добавляет ингредиенты рецепта в итоги корзины"""
+    if created:
+        apply_recipe([instance.user_id], instance.recipe_id)
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def recipe_removed_from_cart(instance, **kwargs):
+    """Убирает ингредиенты рецепта из итогов корзины.
+    pre_delete: при каскадном удалении рецепта его состав еще на месте"""
+    apply_recipe([instance.user_id], instance.recipe_id, sign=-1)
+
+
+@receiver(pre_save, sender=Recipe)
+def remember_recipe_image(instance, **kwargs):
+    """Запоминает прежнее изображение рецепта перед сохранением"""
+    instance._old_image = None
+    if instance.pk:
+        instance._old_image = Recipe.objects.filter(
+            pk=instance.pk
+        ).values_list('image', flat=True).first()
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(instance, created, **kwargs):
+    """Раскладывает новый рецепт по лентам подписчиков, запускает
+    создание вариантов нового изображения и освобождает замененное"""
+    if created:
+        publish(instance)
+    schedule_variants(instance)
+    old_image = getattr(instance, '_old_image', None)
+    if old_image and old_image != instance.image.name:
+        schedule_release(old_image)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    """Освобождает изображение удаленного рецепта"""
+    schedule_release(instance.image.name)
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def recipe_changed(instance, **kwargs):
+    """Сбрасывает кэш представления рецепта"""
+    bump_version_on_commit(RECIPE_VERSION.format(instance.pk))
+
+
+@receiver([post_save, post_delete], sender=IngredientToRecipe)
+def recipe_ingredients_changed(instance, **kwargs):
+    """Сбрасывает кэш представления рецепта при изменении состава"""
+    bump_version_on_commit(RECIPE_VERSION.format(instance.recipe_id))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(instance, action, reverse, pk_set, **kwargs):
+    """Сбрасывает кэш представления рецептов при изменении их тегов"""
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        bump_version_on_commit(RECIPE_VERSION.format(instance.pk))
+    elif pk_set is None:
+        bump_version_on_commit('tags')
+    else:
+        for recipe_id in pk_set:
+            bump_version_on_commit(RECIPE_VERSION.format(recipe_id))
+
+
+@receiver(post_save, sender=User)
+def user_changed(instance, **kwargs):
+    """Сбрасывает кэш представления рецептов автора"""
+    bump_version_on_commit(USER_VERSION.format(instance.pk))
+
+
+@receiver(post_save, sender=Subscription)
+def subscribed(instance, created, **kwargs):
+    """Заполняет ленту рецептами нового автора"""
+    if created:
+        backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Subscription)
+def unsubscribed(instance, **kwargs):
+    """Убирает рецепты автора из ленты"""
+    trim(instance.user_id, instance.author_id)
+
+
+def track_counter(sender, model, field, link):
+    """Подключает поддержку счетчика field у model
+    к созданию и удалению объектов sender"""
+
+    def created(instance, created, **kwargs):
+        if created:
+            change_counter(model, getattr(instance, link), field, 1)
+
+    def deleted(instance, **kwargs):
+        change_counter(model, getattr(instance, link), field, -1)
+
+    post_save.connect(created, sender=sender, weak=False)
+    post_delete.connect(deleted, sender=sender, weak=False)
+
+
+track_counter(Favorite, Recipe, 'favorite_count', 'recipe_id')
+track_counter(ShoppingCart, Recipe, 'cart_count', 'recipe_id')
+track_counter(Recipe, User, 'recipes_count', 'author_id')
+track_counter(Subscription, User, 'followers_count', 'author_id')
+
+
+# Версии таблиц для кэша количества записей в списках (см. pagination)
+for model in (Recipe, Favorite, ShoppingCart, Subscription, User):
+    post_save.connect(bump_table_version, sender=model)
+    post_delete.connect(bump_table_version, sender=model)
+m2m_changed.connect(bump_table_version, sender=Recipe.tags.through)
+
+
+def track_membership(kind):
+    """Подключает смену версии множества kind (см. memberships)
+    к созданию и удалению объектов его модели"""
+
+    def changed(instance, **kwargs):
+        if kwargs.get('created', True):
+            bump_version_on_commit(
+                MEMBERSHIP_VERSION.format(instance.user_id, kind)
+            )
+
+    post_save.connect(changed, sender=MEMBERSHIPS[kind][0], weak=False)
+    post_delete.connect(changed, sender=MEMBERSHIPS[kind][0], weak=False)
+
+
+for kind in MEMBERSHIPS:
+    track_membership(kind)
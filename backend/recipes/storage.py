@@ -0,0 +1,94 @@
+import hashlib
+import os
+import re
+import tempfile
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import connection
+from django.db.transaction import TransactionManagementError
+
+
+CONTENT_NAME = re.compile(r'(^|/)([0-9a-f]{2})/\2[0-9a-f]{62}\.\w+$')
+
+
+def is_content_addressed(name):
+    """Названо ли хранилищем по содержимому"""
+    return bool(CONTENT_NAME.search(name))
+
+
+def lock_name(name):
+    """Блокирует имя файла до конца текущей транзакции.
+    Загрузка берет блокировку до проверки существования файла, а удаление -
+    до проверки ссылок на него, поэтому файл, на который ссылается еще не
+    зафиксированный рецепт, не будет удален. В PostgreSQL - рекомендательная
+    блокировка по имени, в остальных БД - блокировка записи всей БД
+    пустым UPDATE (в SQLite она держится до конца транзакции)"""
+    if not connection.in_atomic_block:
+        raise TransactionManagementError(
+            'Блокировка имени файла действует только в transaction.atomic'
+        )
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            key = int.from_bytes(
+                hashlib.sha256(name.encode()).digest()[:8], 'big', signed=True
+            )
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', [key])
+        else:
+            table = connection.ops.quote_name(
+                apps.get_model('recipes', 'Recipe')._meta.db_table
+            )
+            cursor.execute(f'UPDATE {table} SET id = id WHERE id IS NULL')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, называющее файлы по SHA-256 содержимого:
+    <каталог>/<первые 2 символа хэша>/<хэш><расширение>.
+    Одинаковые файлы хранятся один раз, а имя файла никогда
+    не указывает на другое содержимое"""
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, digest[:2], digest + extension)
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        name = self.content_name(name, content)
+        lock_name(name)
+        if self.exists(name):
+            return name
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        if self.directory_permissions_mode is not None:
+            old_umask = os.umask(0o777 & ~self.directory_permissions_mode)
+            try:
+                os.makedirs(
+                    directory, self.directory_permissions_mode, exist_ok=True
+                )
+            finally:
+                os.umask(old_umask)
+        else:
+            os.makedirs(directory, exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                for chunk in content.chunks():
+                    file.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temporary_path, self.file_permissions_mode)
+            os.replace(temporary_path, full_path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.unlink(temporary_path)
+            raise
+        return name
+
+
+recipe_image_storage = ContentAddressedStorage()
@@ -0,0 +1,102 @@
+"""Битовая маска тегов рецепта: бит Tag.bit выставлен для каждого тега.
+Тегам сверх TAG_MASK_BITS бит не достается, по ним фильтр идет через JOIN"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .cache import bump_version
+from .models import Recipe, Tag
+
+RECIPE_TABLE = f'table:{Recipe._meta.db_table}'
+
+
+def get_tags_mask(tags):
+    """Маска набора тегов"""
+    mask = 0
+    for tag in tags:
+        mask |= tag.mask
+    return mask
+
+
+def assign_bit(tag):
+    """Выдает сохраненному тегу свободный бит, если он есть. Tag.bit
+    уникален: если тот же бит занял параллельно созданный тег,
+    берется следующий"""
+    used = set(Tag.objects.exclude(bit=None).values_list('bit', flat=True))
+    for bit in range(settings.TAG_MASK_BITS):
+        if bit in used:
+            continue
+        try:
+            with transaction.atomic():
+                Tag.objects.filter(pk=tag.pk).update(bit=bit)
+        except IntegrityError:
+            continue
+        tag.bit = bit
+        return
+
+
+def filter_by_tags(queryset, tags, match_all=False):
+    """Рецепты с любым (или со всеми, match_all) из тегов одним условием
+    на tags_mask, без JOIN со связующей таблицей и DISTINCT.
+    Если у какого-то из тегов нет бита - через JOIN"""
+    tags = list(tags)
+    if not tags:
+        return queryset
+    if any(tag.bit is None for tag in tags):
+        if match_all:
+            for tag in tags:
+                queryset = queryset.filter(tags=tag)
+            return queryset
+        return queryset.filter(tags__in=tags).distinct()
+    mask = get_tags_mask(tags)
+    queryset = queryset.alias(matched_tags=F('tags_mask').bitand(mask))
+    if match_all:
+        return queryset.filter(matched_tags=mask)
+    return queryset.exclude(matched_tags=0)
+
+
+def update_tags_mask(recipe):
+    """Пересчитывает маску рецепта по его текущим тегам"""
+    recipe.tags_mask = get_tags_mask(recipe.tags.all())
+    Recipe.objects.filter(pk=recipe.pk).update(tags_mask=recipe.tags_mask)
+    bump_version(RECIPE_TABLE)
+
+
+def release_bit(tag):
+    """Снимает бит удаленного тега со всех рецептов, чтобы его
+    можно было отдать новому тегу"""
+    if tag.bit is None:
+        return
+    filter_by_tags(Recipe.objects.all(), [tag]).update(
+        tags_mask=F('tags_mask').bitand(~tag.mask)
+    )
+    bump_version(RECIPE_TABLE)
+
+
+@transaction.atomic
+def rebuild_tag_masks(dry_run=False):
+    """Выдает биты тегам без них и сверяет маски всех рецептов.
+    Возвращает число рецептов с неверной маской"""
+    if not dry_run:
+        for tag in Tag.objects.filter(bit=None):
+            assign_bit(tag)
+    bits = dict(Tag.objects.exclude(bit=None).values_list('pk', 'bit'))
+    expected = {}
+    for recipe_id, tag_id in Recipe.tags.through.objects.values_list(
+        'recipe_id', 'tag_id'
+    ).iterator():
+        if tag_id in bits:
+            expected[recipe_id] = (
+                expected.get(recipe_id, 0) | 1 << bits[tag_id]
+            )
+    drifted = [
+        Recipe(pk=recipe_id, tags_mask=expected.get(recipe_id, 0))
+        for recipe_id, mask in Recipe.objects.values_list(
+            'pk', 'tags_mask'
+        ).iterator()
+        if mask != expected.get(recipe_id, 0)
+    ]
+    if drifted and not dry_run:
+        Recipe.objects.bulk_update(drifted, ['tags_mask'], batch_size=1000)
+        bump_version(RECIPE_TABLE)
+    return len(drifted)
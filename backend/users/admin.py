@@ -14,9 +14,12 @@ class UserAdmin(admin.ModelAdmin):
         'last_name',
         'email',
         'is_stuff',
+        'recipes_count',
+        'followers_count',
     )
     empty_value_display = '<--пусто-->'
     list_editable = ('is_stuff',)
+    readonly_fields = ('recipes_count', 'followers_count',)
     list_filter = ('username', 'email',)
     search_fields = ('username', 'email',)
     list_per_page = LIST_PER_PAGE
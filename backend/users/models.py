@@ -1,9 +1,10 @@
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import RegexValidator
 from django.db import models
+from foodgram.models import UpdateOnlyFieldsMixin
 
 
-class User(AbstractUser):
+class User(UpdateOnlyFieldsMixin, AbstractUser):
     """Класс модели Пользователя"""
     username = models.CharField(
         max_length=150,
@@ -41,6 +42,18 @@ class User(AbstractUser):
         default=False,
         verbose_name='Статус администратора'
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Рецептов',
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Подписчиков',
+    )
+
+    update_only_fields = ('recipes_count', 'followers_count')
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = [